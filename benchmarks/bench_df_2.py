@@ -0,0 +1,85 @@
+"""Benchmark the df_2 aggregation against the previous per-group lambda version.
+
+Usage: python benchmarks/bench_df_2.py [--sizes 10000 100000 1000000] [--repeat 3]
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loyalty import aggregate_df_2
+from game_index import SHOOTER_TITLES, NONGAMING_TITLES
+
+OTHER_TITLES = [f'Game {i}' for i in range(500)]
+
+def legacy_aggregate_df_2(data):
+    """The lambda-based aggregation df_2 used before vectorization."""
+    grouped = data.groupby('twitch_channel_id').agg(
+        nongaming_airtime=('airtime', lambda x: x[data.loc[x.index, 'is_nongaming']].sum()),
+        shooter_airtime=('airtime', lambda x: x[data.loc[x.index, 'is_shooter']].sum()),
+        nongaming_hw=('hours_watched', lambda x: x[data.loc[x.index, 'is_nongaming']].sum()),
+        shooter_hw=('hours_watched', lambda x: x[data.loc[x.index, 'is_shooter']].sum()),
+        total_airtime=('airtime', 'sum'),
+        total_hw=('hours_watched', 'sum')
+    ).reset_index()
+
+    grouped['pct_shooter'] = grouped['shooter_hw'].fillna(0) / grouped['total_hw']
+    grouped['pct_nonshooter'] = 1 - grouped['pct_shooter']
+    grouped['pct_non_gaming'] = grouped['nongaming_hw'].fillna(0) / grouped['total_hw']
+    grouped['pct_shooter_airtime'] = grouped['shooter_airtime'].fillna(0) / grouped['total_airtime']
+    grouped['pct_nonshooter_airtime'] = 1 - grouped['pct_shooter_airtime']
+
+    return grouped[grouped['total_airtime'] > 30]
+
+def make_rows(n_rows, games_per_channel=10, seed=0):
+    """Synthetic channel x game rows shaped like the df_2 input."""
+    rng = np.random.default_rng(seed)
+    n_channels = max(1, n_rows // games_per_channel)
+    titles = np.array(sorted(SHOOTER_TITLES) + sorted(NONGAMING_TITLES) + OTHER_TITLES)
+
+    channel_ids = rng.integers(1, n_channels + 1, n_rows)
+    samples = rng.integers(1, 600, n_rows)
+    acv = np.floor(rng.pareto(1.5, n_rows) * 10)
+
+    data = pd.DataFrame({
+        'twitch_channel_id': channel_ids,
+        'title': titles[rng.zipf(1.6, n_rows) % len(titles)],
+        'airtime': samples / 6,
+    })
+    data['hours_watched'] = data['airtime'] * acv
+    data['is_shooter'] = data['title'].isin(SHOOTER_TITLES)
+    data['is_nongaming'] = data['title'].isin(NONGAMING_TITLES)
+
+    return data
+
+def best_time(func, data, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(data)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'legacy_s':>10} {'vectorized_s':>13} {'speedup':>8}")
+    for size in args.sizes:
+        data = make_rows(size)
+        legacy_time, expected = best_time(legacy_aggregate_df_2, data, args.repeat)
+        vectorized_time, result = best_time(aggregate_df_2, data, args.repeat)
+
+        pd.testing.assert_frame_equal(
+            result.reset_index(drop=True), expected.reset_index(drop=True), check_dtype=False
+        )
+        print(f"{size:>10} {legacy_time:>10.3f} {vectorized_time:>13.3f} {legacy_time / vectorized_time:>7.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+import os
+import time
+import threading
+import numpy as np
+import pandas as pd
+from datetime import timedelta
+from collections import OrderedDict
+from sqlalchemy import text, bindparam
+from db import execute_query
+from extract import SCORE_WINDOWS, WINDOW_DAYS, PEEK_AGGREGATES_QUERY, PEEK_DTYPES, compact_peeks, channel_dimension, fetch_current_date
+from loyalty import df_2, fetch_outlier_aggregates, process_df_6, score_loyalty, apply_loyalty_cutoffs, read_loyalty_cutoffs
+from variety_score import GAME_RANKS, GENRE_RANKS, df_1, df_5, variety_category
+
+CACHE_SIZE = int(os.getenv("SCORE_CACHE_SIZE", 10000))
+CACHE_TTL = float(os.getenv("SCORE_CACHE_TTL", 300))
+# Larger requests should wait for the batch run
+MAX_CHANNELS = int(os.getenv("SCORE_MAX_CHANNELS", 100))
+
+SCORE_COLUMNS = [
+    'twitch_channel_id', 'window_days', 'name', 'lang', 'acv', 'pct_shooter_airtime',
+    'variety_game_score', 'variety_cat', 'final_loyalty_score', 'loyalty_category',
+    *[f'game_rank_{i}' for i in range(1, GAME_RANKS + 1)],
+    *[f'genre_rank_{i}' for i in range(1, GENRE_RANKS + 1)]
+]
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+_cache = TTLCache()
+_missing = object()
+
+def fetch_channel_peeks(channel_ids, today, window_days=WINDOW_DAYS):
+    """The shared peek table for just these channels, filtered in the database."""
+    query = text(PEEK_AGGREGATES_QUERY.format(
+        where="pulled_at >= :since AND twitch_channel_id IN :channel_ids"
+    )).bindparams(
+        bindparam('channel_ids', value=[int(i) for i in channel_ids], expanding=True),
+        since=today - timedelta(days=int(window_days))
+    )
+
+    data = execute_query(query).astype(PEEK_DTYPES)
+
+    return compact_peeks(data)
+
+def compute_channel_scores(channel_ids, window_days=WINDOW_DAYS, cutoffs=None):
+    """Score the given channels with the batch stages, one row per channel that qualifies.
+
+    Loyalty categories use the cutoffs saved by the last batch run, with the
+    outer edges opened so scores beyond the batch range still get a category.
+    """
+    today = fetch_current_date()
+    peeks = fetch_channel_peeks(channel_ids, today, window_days)
+    if peeks.empty:
+        return pd.DataFrame(columns=SCORE_COLUMNS)
+
+    df_2_result = df_2(peeks)
+    outliers = fetch_outlier_aggregates(today, [window_days], channel_ids=channel_ids)
+    loyalty = score_loyalty(process_df_6(df_2_result, outliers, window_days))
+    cutoffs = cutoffs or read_loyalty_cutoffs(window_days)
+    if cutoffs is not None:
+        loyalty['loyalty_category'] = apply_loyalty_cutoffs(loyalty['final_loyalty_score'], *cutoffs, clip=True)
+    else:
+        loyalty['loyalty_category'] = None
+
+    variety = df_5(df_2_result, df_1(peeks), peeks)
+    scores = variety.merge(loyalty, on='twitch_channel_id', how='left')
+    scores = scores.merge(channel_dimension(peeks), on='twitch_channel_id', how='left')
+    scores['variety_cat'] = variety_category(scores['variety_game_score'])
+    scores['window_days'] = window_days
+
+    return scores[SCORE_COLUMNS]
+
+def score_record(row):
+    """Plain-Python dict of one score row, with nulls as None."""
+    record = {}
+    for column, value in row.items():
+        if pd.isna(value):
+            value = None
+        elif isinstance(value, np.generic):
+            value = value.item()
+        record[column] = value
+    return record
+
+def score_channels(channel_ids, window_days=WINDOW_DAYS, cache=_cache):
+    """Return {channel_id: scores or None} over `window_days` for up to MAX_CHANNELS channels.
+
+    Cached results are served until they expire; the rest are computed in one
+    pushed-down query. None means the channel did not qualify for scoring
+    (too little airtime in the window or no known name/language).
+    """
+    channel_ids = list(dict.fromkeys(int(channel_id) for channel_id in channel_ids))
+    if len(channel_ids) > MAX_CHANNELS:
+        raise ValueError(f"At most {MAX_CHANNELS} channels can be scored at once, got {len(channel_ids)}")
+
+    window_days = int(window_days)
+    if window_days not in SCORE_WINDOWS:
+        raise ValueError(f"window_days must be one of {SCORE_WINDOWS}, got {window_days}")
+
+    results = {channel_id: cache.get((channel_id, window_days), _missing) for channel_id in channel_ids}
+    missing = [channel_id for channel_id, result in results.items() if result is _missing]
+    if missing:
+        scores = compute_channel_scores(missing, window_days)
+        computed = {record['twitch_channel_id']: record for record in map(score_record, scores.to_dict('records'))}
+        for channel_id in missing:
+            results[channel_id] = computed.get(channel_id)
+            cache.put((channel_id, window_days), results[channel_id])
+
+    return results
@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+import pyarrow as pa
+
+CHECKPOINT_DIR = os.getenv(
+    "CHECKPOINT_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "state", "runs")
+)
+MANIFEST = "_manifest.json"
+LATEST = "latest.json"
+# Failed runs older than this many seconds are started over instead of resumed
+CHECKPOINT_MAX_AGE = float(os.getenv("CHECKPOINT_MAX_AGE", 3600))
+
+def file_fingerprint(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def write_feather(df, path):
+    """Write an uncompressed Feather (Arrow IPC) file atomically and return its fingerprint."""
+    table = pa.Table.from_pandas(df)
+    with pa.OSFile(path + ".tmp", 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(path + ".tmp", path)
+
+    return file_fingerprint(path)
+
+def open_feather(path):
+    """Memory-map a Feather file as an Arrow table without copying its buffers."""
+    return pa.ipc.open_file(pa.memory_map(path)).read_all()
+
+def run_key(**settings):
+    """Identify runs whose checkpoints can be resumed by the day and settings they score for."""
+    payload = json.dumps(settings, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+class RunCheckpoints:
+    """Stage outputs of one run, kept as fingerprinted Feather files in its run directory.
+
+    A checkpoint is valid when its file still matches the fingerprint recorded
+    in the manifest when it was written; anything else is recomputed. The
+    manifest also keeps the source watermark of the run's first attempt, which
+    is what a resumed run has published once it completes.
+    """
+
+    def __init__(self, run_dir, key=None, watermark=None):
+        self.run_dir = run_dir
+        self._lock = threading.Lock()
+        self._valid = {}
+        os.makedirs(run_dir, exist_ok=True)
+        self.manifest = read_run_manifest(run_dir) or {
+            'key': key, 'started_at': time.time(), 'watermark': watermark, 'checkpoints': {}, 'complete': False
+        }
+
+    @property
+    def watermark(self):
+        return self.manifest.get('watermark')
+
+    def _write_manifest(self):
+        path = os.path.join(self.run_dir, MANIFEST)
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(path + ".tmp", path)
+
+    def path(self, name):
+        return os.path.join(self.run_dir, f"{name}.feather")
+
+    def has(self, name):
+        with self._lock:
+            if name not in self._valid:
+                entry = self.manifest['checkpoints'].get(name)
+                path = self.path(name)
+                self._valid[name] = (
+                    entry is not None and os.path.exists(path) and file_fingerprint(path) == entry['sha256']
+                )
+            return self._valid[name]
+
+    def load(self, name):
+        df = open_feather(self.path(name)).to_pandas()
+        print(f"Restored {name} from checkpoint ({df.shape[0]} rows)")
+        return df
+
+    def save(self, name, df):
+        fingerprint = write_feather(df, self.path(name))
+        with self._lock:
+            self.manifest['checkpoints'][name] = {'sha256': fingerprint, 'rows': len(df)}
+            self._valid[name] = True
+            self._write_manifest()
+
+    def complete(self, final_name='final'):
+        """Mark the run published, point `latest` at its final snapshot and drop older runs."""
+        with self._lock:
+            self.manifest['complete'] = True
+            self._write_manifest()
+
+        root = os.path.dirname(self.run_dir)
+        latest = {
+            'run_dir': os.path.basename(self.run_dir),
+            'path': os.path.join(os.path.basename(self.run_dir), f"{final_name}.feather"),
+            'sha256': self.manifest['checkpoints'][final_name]['sha256']
+        }
+        with open(os.path.join(root, LATEST + ".tmp"), "w") as f:
+            json.dump(latest, f, indent=2)
+        os.replace(os.path.join(root, LATEST + ".tmp"), os.path.join(root, LATEST))
+
+        for entry in os.listdir(root):
+            run_dir = os.path.join(root, entry)
+            if os.path.isdir(run_dir) and run_dir != self.run_dir:
+                shutil.rmtree(run_dir, ignore_errors=True)
+
+def read_run_manifest(run_dir):
+    path = os.path.join(run_dir, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def open_run_checkpoints(key, watermark=None, root=CHECKPOINT_DIR, fresh=False, max_age=CHECKPOINT_MAX_AGE):
+    """Checkpoints for this run, resuming the newest failed run for `key` started within `max_age` seconds.
+
+    Peeks land continuously, so a retry rarely sees the watermark its failed
+    attempt saw; it resumes that attempt anyway and keeps its watermark, so the
+    run after it scores the newer data. Other failed runs are removed. Callers
+    must hold the run lock (watermark.acquire_run_lock), so every incomplete
+    run found here has stopped.
+    """
+    os.makedirs(root, exist_ok=True)
+    now = time.time()
+    failed = []
+    for entry in os.listdir(root):
+        run_dir = os.path.join(root, entry)
+        manifest = read_run_manifest(run_dir) if os.path.isdir(run_dir) else None
+        if os.path.isdir(run_dir) and not (manifest and manifest.get('complete')):
+            failed.append((manifest, run_dir))
+
+    resumable = [
+        (manifest['started_at'], run_dir) for manifest, run_dir in failed
+        if not fresh and manifest and manifest.get('key') == key and now - manifest['started_at'] <= max_age
+    ]
+    run_dir = max(resumable)[1] if resumable else os.path.join(
+        root, f"run-{key}-{time.strftime('%Y%m%dT%H%M%S', time.gmtime(now))}"
+    )
+    for _, failed_dir in failed:
+        if failed_dir != run_dir:
+            shutil.rmtree(failed_dir, ignore_errors=True)
+
+    checkpoints = RunCheckpoints(run_dir, key, watermark)
+    if checkpoints.manifest['checkpoints']:
+        print(f"Resuming run {os.path.basename(run_dir)} with checkpoints: "
+              f"{', '.join(sorted(checkpoints.manifest['checkpoints']))}")
+
+    return checkpoints
+
+def open_final_scores(root=CHECKPOINT_DIR):
+    """Final scores of the last published run as a memory-mapped Arrow table, or None.
+
+    Reads neither database; convert with .to_pandas() when a DataFrame is needed.
+    """
+    path = os.path.join(root, LATEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        latest = json.load(f)
+
+    return open_feather(os.path.join(root, latest['path']))
@@ -0,0 +1,151 @@
+import os
+import gc
+import logging
+import contextvars
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+# Stages that may run at the same time; 1 runs the graph sequentially
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", 4))
+# 'thread' shares frames between stages, 'process' pickles them to worker processes
+PIPELINE_EXECUTOR = os.getenv("PIPELINE_EXECUTOR", "thread")
+
+class Task:
+    """A named pipeline stage and the names of the tasks whose results it takes.
+
+    Tasks marked `checkpoint` save their DataFrame result and are restored
+    from it instead of re-running when a run resumes. Tasks in `after` only
+    order the graph: this task waits for them when they run, without taking
+    their results, e.g. so two stages do not compete for pooled connections.
+    """
+
+    def __init__(self, name, func, deps=(), checkpoint=False, after=()):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.checkpoint = checkpoint
+        self.after = list(after)
+
+def check_graph(tasks):
+    """Raise ValueError for unknown dependencies or cycles; return a topological order."""
+    by_name = {task.name: task for task in tasks}
+    if len(by_name) != len(tasks):
+        raise ValueError("Duplicate task names in pipeline graph")
+    for task in tasks:
+        unknown = [dep for dep in task.deps + task.after if dep not in by_name]
+        if unknown:
+            raise ValueError(f"Task {task.name} depends on unknown tasks {unknown}")
+
+    order = []
+    state = {}
+    def visit(name, path):
+        if state.get(name) == 'done':
+            return
+        if state.get(name) == 'visiting':
+            raise ValueError(f"Cycle in pipeline graph: {' -> '.join(path + [name])}")
+        state[name] = 'visiting'
+        for dep in by_name[name].deps + by_name[name].after:
+            visit(dep, path + [name])
+        state[name] = 'done'
+        order.append(name)
+
+    for task in tasks:
+        visit(task.name, [])
+
+    return order
+
+def needed_tasks(by_name, outputs, restorable):
+    """Tasks the outputs depend on, not looking past tasks that can be restored."""
+    needed = set()
+    stack = list(outputs)
+    while stack:
+        name = stack.pop()
+        if name in needed:
+            continue
+        needed.add(name)
+        if name not in restorable:
+            stack.extend(by_name[name].deps)
+    return needed
+
+def run_dag(tasks, outputs, max_workers=PIPELINE_WORKERS, executor=PIPELINE_EXECUTOR, checkpoints=None):
+    """Run the tasks as soon as their dependencies finish and return the `outputs` results.
+
+    At most `max_workers` tasks run at once. The first failure stops new tasks
+    from starting, waits for the running ones and is re-raised unchanged so the
+    caller's error handling sees the original exception. Results are dropped
+    once every task that needs them has finished, unless listed in `outputs`.
+
+    With `checkpoints`, checkpointed tasks that already have a valid
+    checkpoint are restored, and tasks only they depended on are skipped.
+    """
+    check_graph(tasks)
+    by_name = {task.name: task for task in tasks}
+    restorable = set()
+    if checkpoints is not None:
+        restorable = {task.name for task in tasks if task.checkpoint and checkpoints.has(task.name)}
+    needed = needed_tasks(by_name, outputs, restorable)
+
+    results = {name: checkpoints.load(name) for name in needed & restorable}
+    pending = needed - restorable
+    remaining_deps = {
+        name: (set(by_name[name].deps) | (set(by_name[name].after) & pending)) - restorable
+        for name in pending
+    }
+    consumers = {name: 0 for name in needed}
+    for name in pending:
+        for dep in set(by_name[name].deps):
+            consumers[dep] += 1
+
+    running = {}
+    error = None
+    if executor == 'process':
+        # Spawned workers avoid inheriting locks held by the parent's threads at fork time
+        pool = ProcessPoolExecutor(max_workers=max(1, max_workers), mp_context=multiprocessing.get_context('spawn'))
+    else:
+        pool = ThreadPoolExecutor(max_workers=max(1, max_workers))
+
+    with pool:
+        def submit(name):
+            task = by_name[name]
+            args = [results[dep] for dep in task.deps]
+            if executor == 'process':
+                future = pool.submit(task.func, *args)
+            else:
+                # Threads inherit the caller's context so stage metrics nest as before
+                future = pool.submit(contextvars.copy_context().run, task.func, *args)
+            running[future] = name
+            del remaining_deps[name]
+
+        for name in [name for name, deps in remaining_deps.items() if not deps]:
+            submit(name)
+
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                    if checkpoints is not None and by_name[name].checkpoint:
+                        checkpoints.save(name, results[name])
+                except Exception as e:
+                    logging.error(f"Pipeline task {name} failed: {e}")
+                    if error is None:
+                        error = e
+                    continue
+
+                for dep in set(by_name[name].deps):
+                    consumers[dep] -= 1
+                    if consumers[dep] == 0 and dep not in outputs:
+                        results.pop(dep, None)
+                for deps in remaining_deps.values():
+                    deps.discard(name)
+                gc.collect()    # Trigger garbage collection to clean up any unused memory
+
+            if error is None:
+                for name in [name for name, deps in remaining_deps.items() if not deps]:
+                    submit(name)
+
+    if error is not None:
+        raise error
+
+    return tuple(results[name] for name in outputs)
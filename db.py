@@ -0,0 +1,79 @@
+import os
+import time
+import threading
+import pandas as pd
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+from instrumentation import record_query
+
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+CHUNK_SIZE = int(os.getenv("QUERY_CHUNK_SIZE", 100000))
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def db_connection(**engine_options):
+    load_dotenv()
+
+    db_host = os.getenv("twitch_DB_HOST")
+    db_port = int(os.getenv("twitch_DB_PORT"))
+    db_user = os.getenv("twitch_DB_USER")
+    db_password = os.getenv("twitch_DB_PASSWORD")
+    db_name = os.getenv("twitch_DB_NAME")
+
+    db_url = f'postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}'
+    engine = create_engine(db_url, echo=False, **engine_options)
+
+    return engine
+
+def get_engine():
+    """Return the module-level pooled engine, creating it on first use."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = db_connection(pool_size=POOL_SIZE, max_overflow=0, pool_pre_ping=True)
+        return _engine
+
+def dispose_engine():
+    """Close every pooled connection."""
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            _engine.dispose()
+            _engine = None
+            print("Database connection closed.")
+
+def execute_query(query, engine=None):
+    """Execute a SQL query on the pooled engine and return a Pandas DataFrame."""
+    engine = engine or get_engine()
+
+    start = time.perf_counter()
+    with engine.connect() as connection:
+        result = pd.read_sql(query, connection)
+    record_query(time.perf_counter() - start, len(result))
+
+    return result
+
+def stream_query(query, chunksize=CHUNK_SIZE, dtypes=None, engine=None):
+    """Execute a SQL query with a server-side cursor and yield DataFrame chunks.
+
+    Only `chunksize` rows are held in memory at a time; `dtypes` casts every
+    chunk so callers can fold them into aggregates without re-inferring types.
+    """
+    engine = engine or get_engine()
+
+    seconds = 0.0
+    rows = 0
+    with engine.connect() as connection:
+        connection = connection.execution_options(stream_results=True, max_row_buffer=chunksize)
+        start = time.perf_counter()
+        chunks = iter(pd.read_sql(query, connection, chunksize=chunksize))
+        try:
+            for chunk in chunks:
+                seconds += time.perf_counter() - start
+                rows += len(chunk)
+                yield chunk.astype(dtypes) if dtypes else chunk
+                start = time.perf_counter()
+            seconds += time.perf_counter() - start
+        finally:
+            record_query(seconds, rows)
@@ -0,0 +1,213 @@
+import os
+import contextvars
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import text
+from db import POOL_SIZE, execute_query, get_engine, stream_query
+
+# Scoring windows in days; one output row per channel and window
+SCORE_WINDOWS = sorted({int(days) for days in os.getenv("SCORE_WINDOWS", "7,30,90").split(",")})
+# The shared extraction covers the longest window
+WINDOW_DAYS = max(SCORE_WINDOWS)
+FETCH_BATCHES = int(os.getenv("FETCH_BATCHES", 5))
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", POOL_SIZE))
+
+PEEK_SCHEMA = pa.schema([
+    ('day', pa.date32()),
+    ('twitch_channel_id', pa.int64()),
+    ('twitch_game_id', pa.int64()),
+    ('name', pa.string()),
+    ('lang', pa.string()),
+    ('title', pa.string()),
+    ('samples', pa.int64()),
+    ('viewers_sum', pa.int64()),
+])
+PEEK_DTYPES = {'samples': 'int64', 'viewers_sum': 'int64'}
+
+# Per-day viewer counts of the peeks the outlier filter reads; days merge by summing samples
+VIEWER_HISTOGRAM_SCHEMA = pa.schema([
+    ('day', pa.date32()),
+    ('twitch_channel_id', pa.int64()),
+    ('twitch_game_id', pa.int64()),
+    ('viewers', pa.int64()),
+    ('samples', pa.int64()),
+])
+VIEWER_HISTOGRAM_DTYPES = {'viewers': 'int64', 'samples': 'int64'}
+
+VIEWER_HISTOGRAM_DAYS_QUERY = """
+    SELECT sp.pulled_at::date AS day, sp.twitch_channel_id, sp.twitch_game_id, sp.viewers, COUNT(*) AS samples
+    FROM stream_peeks sp
+    JOIN channels ON channels.twitch_channel_id = sp.twitch_channel_id
+    JOIN games ON games.twitch_game_id = sp.twitch_game_id
+    WHERE sp.pulled_at >= :start_day AND sp.pulled_at < :end_day
+    GROUP BY 1, 2, 3, 4
+"""
+
+PEEK_AGGREGATES_QUERY = """
+    WITH peeks AS (
+        SELECT
+            pulled_at::date AS day,
+            twitch_channel_id,
+            twitch_game_id,
+            COUNT(*) AS samples,
+            SUM(viewers) AS viewers_sum
+        FROM stream_peeks
+        WHERE {where}
+        GROUP BY 1, 2, 3
+    )
+    SELECT
+        p.day,
+        p.twitch_channel_id,
+        p.twitch_game_id,
+        channels.name,
+        channels.language AS lang,
+        games.title,
+        p.samples,
+        p.viewers_sum
+    FROM peeks p
+    LEFT JOIN games ON games.twitch_game_id = p.twitch_game_id
+    LEFT JOIN channels ON channels.twitch_channel_id = p.twitch_channel_id
+"""
+
+def fetch_peek_days(start_day, end_day, engine=None):
+    """Stream the peek aggregates for the days in [start_day, end_day] into an Arrow table."""
+    query = text(PEEK_AGGREGATES_QUERY.format(
+        where="pulled_at >= :start_day AND pulled_at < :end_day"
+    )).bindparams(start_day=start_day, end_day=end_day + timedelta(days=1))
+
+    tables = [
+        peek_chunk_table(chunk)
+        for chunk in stream_query(query, dtypes=PEEK_DTYPES, engine=engine)
+    ]
+    table = pa.concat_tables(tables) if tables else peek_chunk_table(pd.DataFrame(columns=PEEK_SCHEMA.names))
+    print(f"Fetched {table.num_rows} peek aggregate rows for {start_day} to {end_day}")
+
+    return table
+
+def fetch_viewer_histogram_days(start_day, end_day, engine=None):
+    """Stream the per-day viewer histograms for the days in [start_day, end_day] into an Arrow table."""
+    query = text(VIEWER_HISTOGRAM_DAYS_QUERY).bindparams(start_day=start_day, end_day=end_day + timedelta(days=1))
+
+    tables = [
+        pa.Table.from_pandas(chunk[VIEWER_HISTOGRAM_SCHEMA.names], schema=VIEWER_HISTOGRAM_SCHEMA, preserve_index=False)
+        for chunk in stream_query(query, dtypes=VIEWER_HISTOGRAM_DTYPES, engine=engine)
+        if not chunk.empty
+    ]
+    table = pa.concat_tables(tables) if tables else VIEWER_HISTOGRAM_SCHEMA.empty_table()
+    print(f"Fetched {table.num_rows} viewer histogram rows for {start_day} to {end_day}")
+
+    return table
+
+def peek_chunk_table(chunk):
+    """Convert a fetched chunk to an Arrow table with dictionary-encoded strings."""
+    table = pa.Table.from_pandas(chunk[PEEK_SCHEMA.names], schema=PEEK_SCHEMA, preserve_index=False)
+    for column in ['name', 'lang', 'title']:
+        index = table.schema.get_field_index(column)
+        table = table.set_column(index, column, table.column(column).dictionary_encode())
+
+    return table
+
+def get_date_batches(start_day, end_day, batches=FETCH_BATCHES):
+    """Split [start_day, end_day] into at most `batches` contiguous day ranges."""
+    days = (end_day - start_day).days + 1
+    batches = max(1, min(batches, days))
+    bounds = np.linspace(0, days, batches + 1).round().astype(int)
+
+    return [
+        (start_day + timedelta(days=int(lo)), start_day + timedelta(days=int(hi) - 1))
+        for lo, hi in zip(bounds[:-1], bounds[1:])
+    ]
+
+def fetch_peek_batches(start_day, end_day, batches=FETCH_BATCHES, workers=FETCH_WORKERS, fetch_days=fetch_peek_days):
+    """Fetch [start_day, end_day] as concurrent date batches over the pooled engine.
+
+    Each batch is streamed into Arrow tables chunk by chunk and the tables
+    are concatenated once at the end instead of growing a DataFrame.
+    `fetch_days` reads one batch, e.g. fetch_viewer_histogram_days.
+    """
+    periods = get_date_batches(start_day, end_day, batches)
+    workers = max(1, min(workers, len(periods)))
+    engine = get_engine()
+
+    # Each batch runs in a copy of the caller's context so its query time counts toward the stage
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(contextvars.copy_context().run, fetch_days, *period, engine=engine)
+            for period in periods
+        ]
+        tables = [future.result() for future in futures]
+
+    return pa.concat_tables(tables).to_pandas()
+
+def fetch_current_date():
+    """Return the database's CURRENT_DATE so day buckets line up with the SQL windows."""
+    today = execute_query(text("SELECT CURRENT_DATE AS today"))['today'].iloc[0]
+
+    return pd.Timestamp(today).date()
+
+def compact_peeks(data):
+    """Downcast the extracted frame to a compact columnar layout."""
+    data['day'] = pd.to_datetime(data['day'])
+    for column in ['name', 'lang', 'title']:
+        # Arrow dictionaries keep first-seen order; sorted categories keep
+        # groupby and rank ties in the same alphabetical order as before
+        values = data[column].astype('category')
+        data[column] = values.cat.reorder_categories(values.cat.categories.sort_values())
+    data = data.astype(PEEK_DTYPES)
+
+    return data
+
+def channel_game_totals(peeks, since=None, columns=('name', 'lang', 'title')):
+    """Roll the peek table up to one row per channel x game.
+
+    `samples` is the number of raw peeks and `viewers_sum` their total viewers,
+    so averages and airtime match the per-query SQL aggregates they replace.
+    """
+    if since is not None:
+        peeks = peeks[peeks['day'] >= pd.Timestamp(since)]
+
+    keys = ['twitch_channel_id', 'twitch_game_id', *columns]
+    totals = peeks.groupby(keys, observed=True, dropna=False, sort=False).agg(
+        samples=('samples', 'sum'),
+        viewers_sum=('viewers_sum', 'sum')
+    ).reset_index()
+
+    return totals
+
+def window_peeks(peeks, today, window_days):
+    """Rows of the shared peek table from `window_days` days before `today` onwards.
+
+    This is the range every stage read from stream_peeks for that window, so
+    each window rolls up from the same daily table without another extraction.
+    """
+    in_window = (peeks['day'] >= pd.Timestamp(today - timedelta(days=window_days))).to_numpy()
+    if in_window.all():
+        return peeks
+
+    return peeks[in_window].reset_index(drop=True)
+
+def window_rows(frame, window_days):
+    """Rows of a frame computed for several windows at once that belong to `window_days`."""
+    rows = frame[frame['window_days'].to_numpy() == window_days]
+
+    return rows.drop(columns='window_days').reset_index(drop=True)
+
+def channel_dimension(peeks):
+    """One row per channel with the name and language attached at output time."""
+    channels = peeks[['twitch_channel_id', 'name', 'lang']].drop_duplicates('twitch_channel_id')
+
+    return channels[channels['name'].notnull()].reset_index(drop=True)
+
+def channel_acv(peeks):
+    """Average viewers per channel across every game in the window."""
+    totals = peeks.groupby('twitch_channel_id', sort=False).agg(
+        samples=('samples', 'sum'),
+        viewers_sum=('viewers_sum', 'sum')
+    )
+
+    acv = (totals['viewers_sum'] / totals['samples']).rename('acv').reset_index()
+
+    return acv
@@ -0,0 +1,178 @@
+import os
+import re
+import hashlib
+import threading
+import unicodedata
+import numpy as np
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+GENRES_CSV = os.getenv("GAME_GENRES_CSV", os.path.join(REPO_DIR, "game_genres.csv"))
+INDEX_PATH = os.getenv("GAME_INDEX_PATH", os.path.join(REPO_DIR, "state", "game_index.npz"))
+# Bump when the cached layout or title normalization changes
+INDEX_VERSION = 1
+
+# Define Game Categories
+NONGAMING_TITLES = {'Just Chatting'}
+SHOOTER_TITLES = {
+    'Valorant', 'Fortnite', 'Apex Legends', 'Counter-Strike: Global Offensive',
+    'Escape From Tarkov', 'Overwatch 2', "PLAYERUNKNOWN'S BATTLEGROUNDS",
+    "Tom Clancy's Rainbow Six: Siege", 'Rust', 'Call of Duty: Modern Warfare II',
+    'DayZ', 'Destiny 2', 'HELLDIVERS II', 'Call of Duty: Black Ops 6',
+    'Deadlock', 'Counter-Strike', 'Call of Duty: Warzone',
+    "Tom Clancy's Rainbow Six Siege", 'Escape from Tarkov: Arena'
+}
+
+_lock = threading.Lock()
+_index = None
+
+def normalize_title(title):
+    """Case-, accent- and punctuation-insensitive form of a game title."""
+    title = unicodedata.normalize('NFKD', str(title)).casefold()
+    title = ''.join(c for c in title if not unicodedata.combining(c))
+    title = re.sub(r"['\u2019]", '', title)
+    return re.sub(r'[\W_]+', ' ', title).strip()
+
+class GameIndex:
+    """Genre and shooter/non-gaming flags for every known title.
+
+    Entry i describes titles[i]; one extra trailing entry (no genre, no flags)
+    is what unknown games resolve to, so row -1 can be used as an index.
+    """
+
+    def __init__(self, titles, keys, key_rows, genre_codes, genres, is_shooter, is_nongaming, fingerprint):
+        self.titles = titles
+        self.keys = keys
+        self.key_rows = key_rows
+        self.genre_codes = genre_codes
+        self.genres = genres
+        self.is_shooter = is_shooter
+        self.is_nongaming = is_nongaming
+        self.fingerprint = fingerprint
+
+    def title_rows(self, titles):
+        """Resolve titles exactly, falling back to the normalized title; -1 if unknown."""
+        titles = np.asarray(titles, dtype=str)
+        rows = np.full(len(titles), -1, dtype='int64')
+        if len(self.titles) == 0 or len(titles) == 0:
+            return rows
+
+        position = np.minimum(np.searchsorted(self.titles, titles), len(self.titles) - 1)
+        exact = self.titles[position] == titles
+        rows[exact] = position[exact]
+
+        missing = np.flatnonzero(~exact)
+        if len(missing):
+            keys = np.array([normalize_title(title) for title in titles[missing]], dtype=str)
+            position = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+            found = self.keys[position] == keys
+            rows[missing[found]] = self.key_rows[position[found]]
+
+        return rows
+
+    def game_rows(self, game_ids, titles):
+        """Index row for every (twitch_game_id, title) pair.
+
+        Each distinct game id is classified once from its title and broadcast
+        back to the rows, so only the distinct games are matched as strings.
+        """
+        ids, first = np.unique(np.asarray(game_ids, dtype='int64'), return_index=True)
+        if len(ids) == 0:
+            return np.empty(0, dtype='int64')
+        titles = pd.Series(titles).iloc[first]
+        rows = np.full(len(ids), -1, dtype='int64')
+        known = titles.notnull().to_numpy()
+        rows[known] = self.title_rows(titles[known].astype(str).to_numpy())
+
+        return rows[np.searchsorted(ids, np.asarray(game_ids, dtype='int64'))]
+
+    def genre(self, rows):
+        """Genres of the given rows as a categorical, null where the game has none."""
+        return pd.Categorical.from_codes(self.genre_codes[rows], categories=self.genres)
+
+def csv_fingerprint(csv_path=GENRES_CSV):
+    """Hash of the genre CSV, the flag sets and the index layout."""
+    digest = hashlib.sha256(f"v{INDEX_VERSION}".encode())
+    with open(csv_path, 'rb') as f:
+        digest.update(f.read())
+    for titles in [SHOOTER_TITLES, NONGAMING_TITLES]:
+        digest.update("\0".join(sorted(titles)).encode())
+        digest.update(b"\1")
+
+    return digest.hexdigest()
+
+def build_game_index(csv_path=GENRES_CSV, fingerprint=None):
+    """Compile the genre CSV and flag sets into sorted lookup arrays."""
+    genres = pd.read_csv(csv_path).dropna(subset=['Game', 'Primary Genre'])
+    genres = genres.drop_duplicates('Game')
+    genre_by_title = dict(zip(genres['Game'], genres['Primary Genre']))
+
+    titles = np.array(sorted(set(genre_by_title) | SHOOTER_TITLES | NONGAMING_TITLES), dtype=str)
+    genre_names = np.array(sorted(set(genre_by_title.values())), dtype=str)
+    genre_codes = np.array([
+        np.searchsorted(genre_names, genre_by_title[title]) if title in genre_by_title else -1
+        for title in titles
+    ], dtype='int64')
+    is_shooter = np.array([title in SHOOTER_TITLES for title in titles], dtype=bool)
+    is_nongaming = np.array([title in NONGAMING_TITLES for title in titles], dtype=bool)
+
+    # First title wins when several normalize to the same key
+    normalized = np.array([normalize_title(title) for title in titles], dtype=str)
+    keys, key_rows = np.unique(normalized, return_index=True)
+
+    return GameIndex(
+        titles=titles,
+        keys=keys,
+        key_rows=key_rows.astype('int64'),
+        genre_codes=np.append(genre_codes, -1),
+        genres=genre_names,
+        is_shooter=np.append(is_shooter, False),
+        is_nongaming=np.append(is_nongaming, False),
+        fingerprint=fingerprint or csv_fingerprint(csv_path)
+    )
+
+def save_game_index(index, index_path=INDEX_PATH):
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    with open(index_path + ".tmp", 'wb') as f:
+        np.savez_compressed(
+            f,
+            titles=index.titles,
+            keys=index.keys,
+            key_rows=index.key_rows,
+            genre_codes=index.genre_codes,
+            genres=index.genres,
+            is_shooter=index.is_shooter,
+            is_nongaming=index.is_nongaming,
+            fingerprint=np.array(index.fingerprint)
+        )
+    os.replace(index_path + ".tmp", index_path)
+
+def read_game_index(index_path=INDEX_PATH):
+    if not os.path.exists(index_path):
+        return None
+    with np.load(index_path, allow_pickle=False) as data:
+        arrays = {name: data[name] for name in data.files}
+    arrays['fingerprint'] = str(arrays['fingerprint'])
+
+    return GameIndex(**arrays)
+
+def load_game_index(csv_path=GENRES_CSV, index_path=INDEX_PATH):
+    """Return the cached index, rebuilding it when the CSV or flag sets changed."""
+    fingerprint = csv_fingerprint(csv_path)
+    index = read_game_index(index_path)
+    if index is not None and index.fingerprint == fingerprint:
+        return index
+
+    print(f"Rebuilding game index from {csv_path}")
+    index = build_game_index(csv_path, fingerprint)
+    save_game_index(index, index_path)
+
+    return index
+
+def get_game_index():
+    """Process-wide game index, loaded on first use."""
+    global _index
+    with _lock:
+        if _index is None:
+            _index = load_game_index()
+        return _index
@@ -0,0 +1,165 @@
+import os
+import json
+import time
+import logging
+import threading
+import functools
+import contextvars
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+SAMPLE_INTERVAL = 0.02
+
+_lock = threading.Lock()
+_active = set()
+# Stage metrics of the current run; None until reset_metrics starts collecting a run summary
+_run_metrics = None
+_sampler = None
+_stage_stack = contextvars.ContextVar('stage_stack', default=())
+
+class StageRecord:
+    """Mutable counters for one running stage."""
+
+    def __init__(self, name, parent, rss):
+        self.name = name
+        self.parent = parent
+        self.db_s = 0.0
+        self.queries = 0
+        self.peak_rss = rss
+
+def current_rss():
+    """Resident set size in bytes, or 0 where /proc is unavailable."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        return 0
+
+def _sample_rss():
+    """Background loop raising the peak RSS of every running stage."""
+    while True:
+        rss = current_rss()
+        with _lock:
+            for record in _active:
+                record.peak_rss = max(record.peak_rss, rss)
+        time.sleep(SAMPLE_INTERVAL)
+
+def _ensure_sampler():
+    global _sampler
+    with _lock:
+        if _sampler is None:
+            _sampler = threading.Thread(target=_sample_rss, name='rss-sampler', daemon=True)
+            _sampler.start()
+
+def count_rows(value):
+    """Rows in a DataFrame, or in every DataFrame of a tuple/list."""
+    if isinstance(value, pd.DataFrame):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        counts = [count for count in map(count_rows, value) if count is not None]
+        return sum(counts) if counts else None
+    return None
+
+def current_stage():
+    stack = _stage_stack.get()
+    return stack[-1].name if stack else None
+
+def stage(func):
+    """Record wall time, DB time, rows in/out and memory for a pipeline function.
+
+    Each call is logged as one JSON line and, once reset_metrics has started a
+    run summary, kept for it.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        _ensure_sampler()
+        start_rss = current_rss()
+        record = StageRecord(func.__name__, current_stage(), start_rss)
+        token = _stage_stack.set(_stage_stack.get() + (record,))
+        with _lock:
+            _active.add(record)
+
+        rows_out = None
+        status = 'ok'
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+            rows_out = count_rows(result)
+            return result
+        except Exception:
+            status = 'error'
+            raise
+        finally:
+            wall = time.perf_counter() - start
+            _stage_stack.reset(token)
+            with _lock:
+                _active.discard(record)
+            end_rss = current_rss()
+            metrics = {
+                'event': 'stage',
+                'stage': record.name,
+                'parent': record.parent,
+                'status': status,
+                'wall_s': round(wall, 4),
+                'db_s': round(record.db_s, 4),
+                'pandas_s': round(max(wall - record.db_s, 0.0), 4),
+                'queries': record.queries,
+                'rows_in': count_rows(list(args) + list(kwargs.values())),
+                'rows_out': rows_out,
+                'peak_rss_mb': round(max(record.peak_rss, end_rss) / 2 ** 20, 1),
+                'rss_delta_mb': round((end_rss - start_rss) / 2 ** 20, 1),
+            }
+            with _lock:
+                if _run_metrics is not None:
+                    _run_metrics.append(metrics)
+            logger.info(json.dumps(metrics))
+
+    return wrapper
+
+def record_query(seconds, rows):
+    """Attribute a query's time to every stage running in this context and log it.
+
+    Queries running concurrently add up, so a stage's db_s can exceed its
+    wall time; pandas_s is then reported as zero.
+    """
+    stack = _stage_stack.get()
+    with _lock:
+        for record in stack:
+            record.db_s += seconds
+            record.queries += 1
+    logger.info(json.dumps({
+        'event': 'query',
+        'stage': current_stage(),
+        'db_s': round(seconds, 4),
+        'rows': rows,
+    }))
+
+def reset_metrics():
+    """Start collecting stage metrics for a new run summary.
+
+    Long-running callers such as the scoring service never call this, so
+    their stages are only logged and do not accumulate.
+    """
+    global _run_metrics
+    with _lock:
+        _run_metrics = []
+
+def run_metrics():
+    with _lock:
+        return list(_run_metrics or [])
+
+def format_run_summary(metrics=None):
+    """One line per top-level stage for the Slack report."""
+    metrics = run_metrics() if metrics is None else metrics
+    lines = []
+    for m in metrics:
+        if m['parent'] is not None:
+            continue
+        rows = '' if m['rows_out'] is None else f", {m['rows_out']} rows"
+        lines.append(
+            f"       {m['stage']}: {m['wall_s']:.1f}s (db {m['db_s']:.1f}s, pandas {m['pandas_s']:.1f}s)"
+            f"{rows}, peak {m['peak_rss_mb']:.0f} MB"
+        )
+    return "\n".join(lines)
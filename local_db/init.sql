@@ -0,0 +1,41 @@
+-- Local PostgreSQL stand-in for the Twitch database and the Redshift sink.
+-- Loaded by docker-compose.yml on first start.
+
+CREATE TABLE IF NOT EXISTS channels (
+    twitch_channel_id BIGINT PRIMARY KEY,
+    name TEXT,
+    language TEXT
+);
+
+CREATE TABLE IF NOT EXISTS games (
+    twitch_game_id BIGINT PRIMARY KEY,
+    title TEXT
+);
+
+CREATE TABLE IF NOT EXISTS stream_peeks (
+    twitch_channel_id BIGINT NOT NULL,
+    twitch_game_id BIGINT,
+    viewers INTEGER NOT NULL,
+    pulled_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS stream_peeks_pulled_at_idx ON stream_peeks (pulled_at);
+CREATE INDEX IF NOT EXISTS stream_peeks_channel_pulled_at_idx ON stream_peeks (twitch_channel_id, pulled_at);
+
+CREATE TABLE IF NOT EXISTS loyalty_variety_scores (
+    twitch_channel_id BIGINT,
+    window_days INTEGER,
+    name TEXT,
+    lang TEXT,
+    acv DOUBLE PRECISION,
+    pct_shooter_airtime DOUBLE PRECISION,
+    genre_rank_1 TEXT,
+    game_rank_1 TEXT,
+    variety_game_score DOUBLE PRECISION,
+    final_loyalty_score DOUBLE PRECISION,
+    variety_cat TEXT,
+    loyalty_category TEXT
+);
+
+-- Scores are published per channel and scoring window
+ALTER TABLE loyalty_variety_scores ADD COLUMN IF NOT EXISTS window_days INTEGER;
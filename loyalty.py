@@ -1,78 +1,67 @@
 import os
+import json
 import pandas as pd
-from dotenv import load_dotenv
-from sqlalchemy import create_engine, text
-from datetime import datetime, timedelta
+from datetime import timedelta
 import numpy as np
-
-def db_connection():
-    load_dotenv()
-
-    db_host = os.getenv("twitch_DB_HOST")
-    db_port = int(os.getenv("twitch_DB_PORT"))
-    db_user = os.getenv("twitch_DB_USER")
-    db_password = os.getenv("twitch_DB_PASSWORD")
-    db_name = os.getenv("twitch_DB_NAME")
-
-    db_url = f'postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}'
-    engine = create_engine(db_url, echo=False)
-
-    return engine
-
-def execute_query(query):
-    """Execute a SQL query and return a Pandas DataFrame."""
-    engine = db_connection()
-
-    try:
-        with engine.connect() as connection:
-            result = pd.read_sql(query, connection)  
-            return result
-    finally:
-        engine.dispose()
-        print("Database connection closed.")
-
-def df_2():
+from sqlalchemy import text, bindparam
+from db import execute_query, stream_query
+from extract import SCORE_WINDOWS, WINDOW_DAYS, channel_game_totals, window_rows
+from instrumentation import stage
+from game_index import get_game_index
+
+# 'local' filters viewer histograms in Python, rolled up from the peek store in batch runs and
+# streamed from stream_peeks for single channels; 'sql' pushes quartiles into the database
+OUTLIER_MODE = os.getenv("OUTLIER_MODE", "local")
+# Loyalty category cutoffs of the last published batch, reused by single-channel scoring
+CUTOFFS_PATH = os.getenv(
+    "LOYALTY_CUTOFFS_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "state", "loyalty_cutoffs.json")
+)
+OUTLIER_COLUMNS = ['window_days', 'twitch_channel_id', 'twitch_game_id', 'mean', 'count']
+
+@stage
+def df_2(peeks):
     """Process gaming data and compute shooter/non-shooter metrics."""
-   
-    stream_peeks_query = text("""
-        SELECT a.twitch_channel_id, channels.name, channels.language AS lang, 
-               a.twitch_game_id, games.title, AVG(viewers) AS acv, 
-               COUNT(*)::decimal/6 AS airtime, 
-               (COUNT(*)::decimal/6) * AVG(viewers) AS hours_watched
-        FROM stream_peeks a
-        LEFT JOIN games ON games.twitch_game_id = a.twitch_game_id
-        LEFT JOIN channels ON channels.twitch_channel_id = a.twitch_channel_id 
-        WHERE a.pulled_at >= CURRENT_DATE - INTERVAL '90 days'
-        GROUP BY a.twitch_channel_id, a.twitch_game_id, games.title, channels.name, channels.language
-    """)
-
-    data = execute_query(stream_peeks_query)
+
+    # Channels missing a name or language are left out, as with the old name/lang grouping
+    peeks = peeks[peeks['name'].notnull() & peeks['lang'].notnull()]
+    data = channel_game_totals(peeks, columns=('title',))
+    data['acv'] = data['viewers_sum'] / data['samples']
+    data['airtime'] = data['samples'] / 6
+    data['hours_watched'] = data['airtime'] * data['acv']
     print(f"Row count: {data.shape[0]}")
-    
-    # Define Game Categories
-    nongaming_title = {'Just Chatting'}
-    shooter_titles = {
-        'Valorant', 'Fortnite', 'Apex Legends', 'Counter-Strike: Global Offensive',
-        'Escape From Tarkov', 'Overwatch 2', "PLAYERUNKNOWN'S BATTLEGROUNDS",
-        "Tom Clancy's Rainbow Six: Siege", 'Rust', 'Call of Duty: Modern Warfare II',
-        'DayZ', 'Destiny 2', 'HELLDIVERS II', 'Call of Duty: Black Ops 6',
-        'Deadlock', 'Counter-Strike', 'Call of Duty: Warzone',
-        "Tom Clancy's Rainbow Six Siege", 'Escape from Tarkov: Arena'
-    }
-
-    # Precompute Shooter/Non-Shooter Flags
-    data['is_shooter'] = data['title'].isin(shooter_titles)
-    data['is_nongaming'] = data['title'].isin(nongaming_title)
+
+    # Precompute Shooter/Non-Shooter Flags from the game classification index
+    games = get_game_index()
+    rows = games.game_rows(data['twitch_game_id'], data['title'])
+    data['is_shooter'] = games.is_shooter[rows]
+    data['is_nongaming'] = games.is_nongaming[rows]
+
+    return aggregate_df_2(data)
+
+def aggregate_df_2(data):
+    """Aggregate channel x game rows into per-channel shooter/non-gaming shares.
+
+    The flagged airtime and hours columns are masked up front so a single
+    grouped sum replaces per-group lookups.
+    """
+    is_shooter = data['is_shooter'].to_numpy(dtype=bool)
+    is_nongaming = data['is_nongaming'].to_numpy(dtype=bool)
+    airtime = data['airtime'].to_numpy(dtype='float64')
+    hours_watched = data['hours_watched'].to_numpy(dtype='float64')
+
+    masked = pd.DataFrame({
+        'twitch_channel_id': data['twitch_channel_id'],
+        'nongaming_airtime': np.where(is_nongaming, airtime, 0.0),
+        'shooter_airtime': np.where(is_shooter, airtime, 0.0),
+        'nongaming_hw': np.where(is_nongaming, hours_watched, 0.0),
+        'shooter_hw': np.where(is_shooter, hours_watched, 0.0),
+        'total_airtime': airtime,
+        'total_hw': hours_watched
+    }, index=data.index)
 
     # Aggregations
-    grouped = data.groupby(['twitch_channel_id', 'name', 'lang']).agg(
-        nongaming_airtime=('airtime', lambda x: x[data.loc[x.index, 'is_nongaming']].sum()),
-        shooter_airtime=('airtime', lambda x: x[data.loc[x.index, 'is_shooter']].sum()),
-        nongaming_hw=('hours_watched', lambda x: x[data.loc[x.index, 'is_nongaming']].sum()),
-        shooter_hw=('hours_watched', lambda x: x[data.loc[x.index, 'is_shooter']].sum()),
-        total_airtime=('airtime', 'sum'),
-        total_hw=('hours_watched', 'sum')
-    ).reset_index()
+    grouped = masked.groupby('twitch_channel_id').sum().reset_index()
 
     grouped['pct_shooter'] = grouped['shooter_hw'].fillna(0) / grouped['total_hw']
     grouped['pct_nonshooter'] = 1 - grouped['pct_shooter']
@@ -83,94 +72,242 @@ def df_2():
 
     return df_final
 
-def get_date_batches(start_date, intervals=5, days_per_interval=90 // 5):
-    """Generate start & end date pairs for batching queries."""
-    return [
-        (
-            (start_date - timedelta(days=(i + 1) * days_per_interval - 1)).strftime('%Y-%m-%d'),
-            (start_date - timedelta(days=i * days_per_interval)).strftime('%Y-%m-%d')
-        )
-        for i in range(intervals)
-    ]
+@stage
+def fetch_outlier_aggregates(today, windows=SCORE_WINDOWS, outlier_mode=OUTLIER_MODE, channel_ids=None):
+    """Channel x game mean/count of the peeks left after the 3x IQR filter, for every window.
+
+    Quartiles need each channel's viewer distribution, which the day-grain
+    peek table does not keep, so this stage reads stream_peeks on its own.
+    Window bounds count back from `today`, the database's CURRENT_DATE.
+    Returns window_days, twitch_channel_id, twitch_game_id, mean, count.
+    """
+    if outlier_mode == 'sql':
+        aggregates = pd.concat([
+            fetch_df_6_filtered(today, window_days, channel_ids).assign(window_days=window_days)
+            for window_days in windows
+        ], ignore_index=True)
+    elif outlier_mode == 'local':
+        aggregates = stream_df_6_filtered(today, windows, channel_ids)
+    else:
+        raise ValueError(f"Unknown outlier mode: {outlier_mode}")
+    print(f"Outlier-filtered channel x game rows: {aggregates.shape[0]}")
 
-def fetch_df_6(start_date, end_date):
-    """Fetch gaming data for given date range."""
-    print(f"Fetching data from {start_date} to {end_date}")
-    
-    query = text(f"""
-        SET TIME ZONE 'America/Los_Angeles';
-        SELECT
-            channels.name,
-            games.title,
-            stream_peeks.twitch_channel_id,
-            stream_peeks.viewers,
-            stream_peeks.twitch_game_id
-        FROM stream_peeks
-        JOIN channels ON channels.twitch_channel_id = stream_peeks.twitch_channel_id
-        JOIN games ON games.twitch_game_id = stream_peeks.twitch_game_id
-        WHERE stream_peeks.pulled_at BETWEEN '{end_date} 00:00:00' AND '{start_date} 23:59:59'
-        ORDER BY channels.name;
-    """)
+    return aggregates[OUTLIER_COLUMNS]
+
+@stage
+def process_df_6(df_2, outlier_aggregates, window_days=WINDOW_DAYS):
+    """Keep the window's outlier-filtered channel x game aggregates of the channels in df_2."""
+    df_6 = window_rows(outlier_aggregates, window_days)
+
+    df_6_final = df_6[np.isin(df_6['twitch_channel_id'].to_numpy(), df_2['twitch_channel_id'].to_numpy())]
+    df_6_final = df_6_final.reset_index(drop=True)
+    print(f"Final df_6 shape after outlier removal: {df_6_final.shape}")
+
+    return df_6_final
+
+def window_start(today, window_days):
+    """First day of the outlier window, which includes `today`."""
+    return today - timedelta(days=int(window_days) - 1)
+
+def channel_query(query, channel_ids=None, **fields):
+    """Format the query, restricting it to `channel_ids` through its {channel_filter} when given."""
+    if channel_ids is None:
+        return text(query.format(channel_filter='', **fields))
+
+    return text(query.format(channel_filter="AND sp.twitch_channel_id IN :channel_ids", **fields)).bindparams(
+        bindparam('channel_ids', value=[int(i) for i in channel_ids], expanding=True)
+    )
+
+def fetch_df_6_filtered(today, window_days=WINDOW_DAYS, channel_ids=None):
+    """Compute quartiles and the 3x IQR filter in SQL, returning only channel x game aggregates."""
+    query = channel_query("""
+        WITH peeks AS (
+            SELECT sp.twitch_channel_id, sp.twitch_game_id, sp.viewers
+            FROM stream_peeks sp
+            JOIN channels ON channels.twitch_channel_id = sp.twitch_channel_id
+            JOIN games ON games.twitch_game_id = sp.twitch_game_id
+            WHERE sp.pulled_at >= :since {channel_filter}
+        ),
+        bounds AS (
+            SELECT
+                twitch_channel_id,
+                percentile_cont(0.25) WITHIN GROUP (ORDER BY viewers) AS percentile_25,
+                percentile_cont(0.75) WITHIN GROUP (ORDER BY viewers) AS percentile_75
+            FROM peeks
+            GROUP BY twitch_channel_id
+        )
+        SELECT p.twitch_channel_id, p.twitch_game_id, AVG(p.viewers)::float8 AS mean, COUNT(*) AS count
+        FROM peeks p
+        JOIN bounds b ON b.twitch_channel_id = p.twitch_channel_id
+        WHERE p.viewers >= b.percentile_25 - 3 * (b.percentile_75 - b.percentile_25)
+          AND p.viewers <= b.percentile_75 + 3 * (b.percentile_75 - b.percentile_25)
+        GROUP BY p.twitch_channel_id, p.twitch_game_id
+    """, channel_ids).bindparams(since=window_start(today, window_days))
 
     return execute_query(query)
 
-def process_df_6(df_2):
-    """Process df_6 with batching, outlier removal, and filtering."""
-    today = datetime.today()
-    periods = get_date_batches(today)
-
-    df_6 = pd.DataFrame()
-    for start, end in periods:
-        period_data = fetch_df_6(end, start)
-        df_6 = pd.concat([df_6, period_data], ignore_index=True)
-
-    print(f"Total Row count after fetching: {df_6.shape[0]}")
-
-    # Load df_2 for filtering
-    df_6 = df_6[df_6['name'].isin(df_2['name'].tolist())].reset_index(drop=True)
-    print(f"Filtered df_6 shape: {df_6.shape}")
-
-    def percentile(n):
-        """Return a function that computes the nth percentile."""
-        def percentile_(x):
-            return np.percentile(x, n)
-        percentile_.__name__ = f'percentile_{n}'
-        return percentile_
-
-    df_stats = df_6.groupby('name')['viewers'].agg(
-        iqr=lambda x: np.percentile(x, 75) - np.percentile(x, 25),
-        percentile_25=percentile(25),
-        percentile_75=percentile(75)
+VIEWER_HISTOGRAM_QUERY = """
+    SELECT sp.twitch_channel_id, sp.twitch_game_id, sp.viewers, {window_samples}
+    FROM stream_peeks sp
+    JOIN channels ON channels.twitch_channel_id = sp.twitch_channel_id
+    JOIN games ON games.twitch_game_id = sp.twitch_game_id
+    WHERE sp.pulled_at >= :since {channel_filter}
+    GROUP BY 1, 2, 3
+    ORDER BY 1
+"""
+
+def stream_df_6_filtered(today, windows=SCORE_WINDOWS, channel_ids=None):
+    """Exact 3x IQR filter in Python over one streamed pass of stream_peeks.
+
+    The database collapses repeated viewer counts into per-window sample counts
+    and returns rows ordered by channel, so each chunk's completed channels are
+    filtered and reduced to channel x game aggregates right away; only the
+    channel still being read is carried into the next chunk.
+    """
+    window_samples = ', '.join(
+        f"COUNT(*) FILTER (WHERE sp.pulled_at >= :since_{int(w)}) AS samples_{int(w)}" for w in windows
+    )
+    query = channel_query(VIEWER_HISTOGRAM_QUERY, channel_ids, window_samples=window_samples).bindparams(
+        since=window_start(today, max(windows)),
+        **{f"since_{int(w)}": window_start(today, w) for w in windows}
+    )
+    dtypes = {'viewers': 'int64', **{f"samples_{int(w)}": 'int64' for w in windows}}
+
+    aggregates = []
+    def reduce_channels(rows):
+        aggregates.extend(window_outlier_aggregates(rows, windows))
+
+    carry = None
+    for chunk in stream_query(query, dtypes=dtypes):
+        # An empty result still comes back as one empty chunk
+        if chunk.empty:
+            continue
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        chunk_channels = chunk['twitch_channel_id'].to_numpy()
+        complete = chunk_channels != chunk_channels[-1]
+        reduce_channels(chunk[complete])
+        carry = chunk[~complete]
+    if carry is not None:
+        reduce_channels(carry)
+
+    if not aggregates:
+        return pd.DataFrame(columns=OUTLIER_COLUMNS)
+    return pd.concat(aggregates, ignore_index=True)
+
+@stage
+def histogram_outlier_aggregates(today, viewer_histograms, windows=SCORE_WINDOWS):
+    """fetch_outlier_aggregates rolled up from the peek store's per-day viewer histograms.
+
+    A window's histogram is the sum of its days' sample counts, so the
+    filter runs on local data and stream_peeks is only read for the days the
+    store fetched.
+    """
+    days = viewer_histograms['day'].to_numpy()
+    samples = viewer_histograms['samples'].to_numpy()
+    rows = pd.DataFrame({
+        'twitch_channel_id': viewer_histograms['twitch_channel_id'],
+        'twitch_game_id': viewer_histograms['twitch_game_id'],
+        'viewers': viewer_histograms['viewers'],
+        **{
+            f"samples_{int(w)}": np.where(days >= np.datetime64(window_start(today, w)), samples, 0)
+            for w in windows
+        }
+    })
+    rows = rows.groupby(['twitch_channel_id', 'twitch_game_id', 'viewers'], sort=False).sum().reset_index()
+
+    aggregates = window_outlier_aggregates(rows, windows)
+    aggregates = pd.concat(aggregates, ignore_index=True) if aggregates else pd.DataFrame(columns=OUTLIER_COLUMNS)
+    print(f"Outlier-filtered channel x game rows: {aggregates.shape[0]}")
+
+    return aggregates[OUTLIER_COLUMNS]
+
+def window_outlier_aggregates(rows, windows):
+    """Filter (channel, game, viewers, samples_<window>...) rows for every window; one frame per window."""
+    aggregates = []
+    for window_days in windows:
+        samples = f"samples_{int(window_days)}"
+        in_window = rows[rows[samples].to_numpy() > 0]
+        if not in_window.empty:
+            aggregates.append(filter_df_6_outliers(in_window, samples).assign(window_days=window_days))
+
+    return aggregates
+
+def filter_df_6_outliers(rows, samples='samples'):
+    """Apply the 3x IQR filter to (channel, game, viewers) rows weighted by `samples`.
+
+    Equivalent to filtering every raw peek and aggregating channel x game mean/count.
+    """
+    df_6 = rows.sort_values(['twitch_channel_id', 'viewers'], kind='mergesort').reset_index(drop=True)
+    codes = pd.factorize(df_6['twitch_channel_id'])[0]
+    group_starts = np.flatnonzero(np.diff(codes, prepend=-1))
+
+    percentile_25, percentile_75 = weighted_percentiles(
+        df_6['viewers'].to_numpy(dtype='float64'), df_6[samples].to_numpy(), group_starts, [25, 75]
+    )
+    iqr = percentile_75 - percentile_25
+
+    # Broadcast group statistics back onto the weighted rows
+    group_sizes = np.diff(np.append(group_starts, len(df_6)))
+    upper_bound = np.repeat(percentile_75 + (3 * iqr), group_sizes)
+    lower_bound = np.repeat(percentile_25 - (3 * iqr), group_sizes)
+
+    viewers = df_6['viewers'].to_numpy()
+    df_6_filtered = df_6[(viewers <= upper_bound) & (viewers >= lower_bound)]
+
+    aggregated = df_6_filtered.assign(
+        viewers_sum=df_6_filtered['viewers'] * df_6_filtered[samples]
+    ).groupby(['twitch_channel_id', 'twitch_game_id']).agg(
+        viewers_sum=('viewers_sum', 'sum'),
+        count=(samples, 'sum')
     ).reset_index()
+    aggregated['mean'] = aggregated['viewers_sum'] / aggregated['count']
 
-    # Merge statistics back to df_6
-    df_6 = df_6.merge(df_stats, on='name')
+    return aggregated[['twitch_channel_id', 'twitch_game_id', 'mean', 'count']]
 
-    df_6['upper_bound'] = df_6['percentile_75'] + (3 * df_6['iqr'])
-    df_6['lower_bound'] = df_6['percentile_25'] - (3 * df_6['iqr'])
+def weighted_percentiles(sorted_values, sorted_weights, group_starts, percentiles):
+    """np.percentile (linear) per group over values repeated by their weights.
 
-    df_6_filtered = df_6[
-        (df_6['viewers'] <= df_6['upper_bound']) & (df_6['viewers'] >= df_6['lower_bound'])
-    ]
+    Rows must be sorted by group then value; `group_starts` holds the first row
+    of each group. Returns one array per requested percentile.
 
-    df_6_final = df_6_filtered[['name', 'title', 'twitch_channel_id', 'viewers', 'twitch_game_id']]
-    print(f"Final df_6 shape after outlier removal: {df_6_final.shape}")
+    >>> weighted_percentiles(np.array([1., 2., 4., 3.]), np.array([2, 1, 1, 5]), np.array([0, 3]), [25, 75])
+    [array([1., 3.]), array([2.5, 3. ])]
+    """
+    cum_weights = np.cumsum(sorted_weights)
+    row_ends = np.append(group_starts[1:], len(sorted_values))
+    base = np.where(group_starts > 0, cum_weights[group_starts - 1], 0)
+    counts = cum_weights[row_ends - 1] - base
 
-    return df_6_final
+    results = []
+    for n in percentiles:
+        position = (counts - 1) * (n / 100.0)
+        lower = np.floor(position)
+        upper = np.ceil(position)
+        lower_value = sorted_values[np.searchsorted(cum_weights, base + lower, side='right')]
+        upper_value = sorted_values[np.searchsorted(cum_weights, base + upper, side='right')]
+        results.append(lower_value + (position - lower) * (upper_value - lower_value))
+
+    return results
 
+@stage
 def calculate_loyalty_score(df_removed_outliers):
+    """Score loyalty from the channel x game mean/count aggregates of process_df_6."""
+    return categorize_loyalty(score_loyalty(df_removed_outliers))
 
-    final_df = df_removed_outliers[['name', 'title', 'viewers']]
-    first_group = final_df.groupby(['name', 'title'])['viewers'].agg(['mean', 'count']).reset_index()
+def score_loyalty(df_removed_outliers):
+    """Per-channel loyalty scores; each channel only depends on its own rows."""
+
+    first_group = df_removed_outliers[['twitch_channel_id', 'twitch_game_id', 'mean', 'count']]
     print(f"Shape after first grouping: {first_group.shape}")
  
     first_group = first_group[first_group['count'] > 18]
     print(f"Shape after filtering: {first_group.shape}")
 
-    second_group = first_group.groupby(['name'])['mean'].agg(['mean', 'std']).reset_index()
-    second_group.columns = ['name', 'mean', 'std']
+    second_group = first_group.groupby(['twitch_channel_id'])['mean'].agg(['mean', 'std']).reset_index()
+    second_group.columns = ['twitch_channel_id', 'mean', 'std']
     second_group['score'] = second_group['mean'] / second_group['std']
-    final_group = second_group[['name', 'mean', 'std', 'score']]
+    final_group = second_group[['twitch_channel_id', 'mean', 'std', 'score']]
     print(f"Shape after second grouping: {final_group.shape}")
 
     # Step : Handling NaN in score
@@ -179,20 +316,64 @@ def calculate_loyalty_score(df_removed_outliers):
     # Step : Calculating final loyalty score
     final_group['final_loyalty_score'] = (final_group['score'] - 3.119576806) / 1.62
     final_group = final_group.dropna(subset=['final_loyalty_score'])
-    unique_scores = final_group['final_loyalty_score'].nunique()
+
+    return final_group[['twitch_channel_id', 'final_loyalty_score']]
+
+def loyalty_categories(scores):
+    """Categorize a loyalty score distribution; returns (categories, bin edges, labels).
+
+    An empty distribution has no edges, so callers should not save its cutoffs.
+    """
+    if scores.empty:
+        labels = ['Low', 'Medium', 'High']
+        return pd.Series(pd.Categorical([], categories=labels), index=scores.index, dtype='category'), [], labels
+
+    unique_scores = scores.nunique()
 
     if unique_scores >= 3:
         try:
-            final_group['loyalty_category'] = pd.qcut(final_group['final_loyalty_score'], q=[0, 0.2, 0.5, 1], labels=['Low', 'Medium', 'High'])
+            categories, bins = pd.qcut(scores, q=[0, 0.2, 0.5, 1], labels=['Low', 'Medium', 'High'], retbins=True)
         except ValueError:
-            final_group['loyalty_category'] = pd.qcut(final_group['final_loyalty_score'], q=[0, 0.2, 0.5, 1], labels=['Low', 'Medium', 'High'], duplicates='drop')
-    else:
-        print("Not enough unique loyalty scores, adjusting to two categories.")
-        final_group['loyalty_category'] = pd.cut(final_group['final_loyalty_score'], bins=2, labels=['Low', 'High'])
-
-    final_group = final_group[['name', 'loyalty_category', 'mean', 'std', 'score', 'final_loyalty_score']]
-    
-    loyalty = final_group[['name','loyalty_category','final_loyalty_score']]
+            categories, bins = pd.qcut(scores, q=[0, 0.2, 0.5, 1], labels=['Low', 'Medium', 'High'], retbins=True, duplicates='drop')
+        return categories, list(bins), ['Low', 'Medium', 'High']
+
+    print("Not enough unique loyalty scores, adjusting to two categories.")
+    categories, bins = pd.cut(scores, bins=2, labels=['Low', 'High'], retbins=True)
+    return categories, list(bins), ['Low', 'High']
+
+def apply_loyalty_cutoffs(scores, bins, labels, clip=False):
+    """Bucket scores with the edges of an earlier batch; `clip` opens the outer edges."""
+    bins = list(bins)
+    if clip:
+        bins[0], bins[-1] = -np.inf, np.inf
+
+    return pd.cut(scores, bins=bins, labels=labels, include_lowest=True)
+
+def save_loyalty_cutoffs(cutoffs, path=CUTOFFS_PATH):
+    """Keep the batch's {window_days: (bins, labels)} so single-channel scoring categorizes the same way."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump({
+            str(window_days): {'bins': [float(edge) for edge in bins], 'labels': list(labels)}
+            for window_days, (bins, labels) in cutoffs.items()
+        }, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+def read_loyalty_cutoffs(window_days=WINDOW_DAYS, path=CUTOFFS_PATH):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        cutoffs = json.load(f).get(str(window_days))
+    if cutoffs is None:
+        return None
+    return cutoffs['bins'], cutoffs['labels']
+
+def categorize_loyalty(final_group):
+    """Bucket loyalty scores into categories; the quantiles span every scored channel."""
+    final_group = final_group.copy()
+    final_group['loyalty_category'], _, _ = loyalty_categories(final_group['final_loyalty_score'])
+
+    loyalty = final_group[['twitch_channel_id','loyalty_category','final_loyalty_score']]
     print(f"Final group shape: {loyalty.shape}")
     
     return loyalty
@@ -1,18 +1,25 @@
 import os
-import gc
+import sys
 import time
+import operator
+import functools
 import json
 import logging
-import psycopg2
 import requests
-import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
-from psycopg2.extras import execute_values
-from sqlalchemy import create_engine, text
-from variety_score import df_1, df_5
-from loyalty import df_2, process_df_6, calculate_loyalty_score, db_connection
+from db import dispose_engine
+from peek_store import STORE_DIR, load_viewer_histograms, sync_peek_store
+from extract import SCORE_WINDOWS, WINDOW_DAYS, channel_dimension, fetch_current_date, window_peeks
+from variety_score import VARIETY_MODE, df_1, df_5, fetch_df_4, variety_category
+from sinks import publish_scores
+from watermark import FORCE_RUN, acquire_run_lock, fetch_source_watermark, source_unchanged, write_watermark
+from checkpoints import open_run_checkpoints, run_key
+from dag import Task, run_dag
+from sharding import SCORING_SHARDS, score_sharded
+from instrumentation import stage, reset_metrics, format_run_summary
+from loyalty import OUTLIER_MODE, df_2, fetch_outlier_aggregates, histogram_outlier_aggregates, process_df_6, calculate_loyalty_score, loyalty_categories, save_loyalty_cutoffs
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -27,110 +34,165 @@ def send_slack_message(message):
     if response.status_code != 200:
         logging.error("Failed to send message to Slack: %s", response.text)
 
-def function_call():
+def function_call(windows=SCORE_WINDOWS, checkpoints=None, store_dir=STORE_DIR):
+    """Run the scoring stages for every window as one dependency graph.
 
-    # Loyalty score
-    df_2_result = df_2()
-    gc.collect()     # Trigger garbage collection to clean up any unused memory
-    df_6_result = process_df_6(df_2_result)
-    gc.collect()    # Trigger garbage collection to clean up any unused memory
-    loyalty = calculate_loyalty_score(df_6_result)
-    gc.collect()    # Trigger garbage collection to clean up any unused memory
+    The peek table is extracted once for the longest window and each window
+    rolls up from it; the outlier-filtered viewer aggregates of every window
+    roll up from the store's per-day viewer histograms, or come from the
+    database with OUTLIER_MODE=sql. Within a window the loyalty chain (df_2 ->
+    process_df_6 -> calculate_loyalty_score) and the variety chain (df_1 ->
+    df_5) only share the peek table and df_2, so independent stages of every
+    window run concurrently. Returns ({window_days: (loyalty, variety)}, channels).
 
-    # Variety score
-    df_4_result = df_1()
-    gc.collect()    # Trigger garbage collection to clean up any unused memory
-    variety = df_5(df_2_result, df_4_result)
-    gc.collect()    # Trigger garbage collection to clean up any unused memory
+    With `checkpoints`, stage outputs are saved as they finish and a resumed
+    run restores them instead of recomputing.
+    """
+    tasks = [
+        # Shared stream_peeks extraction, refreshed from the daily partition store
+        Task('peeks', functools.partial(sync_peek_store, store_dir=store_dir, window_days=max(windows))),
+        Task('today', fetch_current_date),
+        Task('channels', channel_dimension, ['peeks'], checkpoint=True),
+    ]
+    if OUTLIER_MODE == 'local':
+        # Outlier-filtered viewer aggregates of every window, rolled up from the store's day histograms
+        tasks += [
+            Task('histograms', functools.partial(load_viewer_histograms, store_dir=store_dir, window_days=max(windows)),
+                 ['today'], after=['peeks']),
+            Task('outliers', functools.partial(histogram_outlier_aggregates, windows=windows), ['today', 'histograms']),
+        ]
+    else:
+        # Outlier-filtered viewer aggregates of every window; waits for the store
+        # so its connection is not taken from the concurrent peek batch fetches
+        tasks.append(
+            Task('outliers', functools.partial(fetch_outlier_aggregates, windows=windows), ['today'], after=['peeks'])
+        )
 
-    return loyalty, variety
+    outputs = []
+    for window_days in windows:
+        w = f"_{window_days}"
+        tasks.append(Task('peeks' + w, functools.partial(window_peeks, window_days=window_days), ['peeks', 'today']))
+
+        if SCORING_SHARDS > 1:
+            # Channel shards score in worker processes and are merged before the loyalty categories
+            tasks += [
+                Task('scores' + w, functools.partial(score_sharded, window_days=window_days), ['peeks' + w, 'outliers']),
+                Task('loyalty' + w, operator.itemgetter(0), ['scores' + w], checkpoint=True),
+                Task('variety' + w, operator.itemgetter(1), ['scores' + w], checkpoint=True),
+            ]
+        else:
+            tasks += [
+                # Loyalty score
+                Task('df_2' + w, df_2, ['peeks' + w], checkpoint=True),
+                Task('df_6' + w, functools.partial(process_df_6, window_days=window_days), ['df_2' + w, 'outliers'], checkpoint=True),
+                Task('loyalty' + w, calculate_loyalty_score, ['df_6' + w], checkpoint=True),
+            ]
+            if VARIETY_MODE == 'sql':
+                # Variety score: one finished row per channel from the database; like the outlier
+                # query it waits for the store so the peek batch fetches get the pooled connections
+                tasks += [
+                    Task('df_4' + w, functools.partial(fetch_df_4, window_days=window_days), after=['peeks']),
+                    Task('variety' + w, df_5, ['df_2' + w, 'df_4' + w], checkpoint=True),
+                ]
+            else:
+                tasks += [
+                    # Variety score
+                    Task('df_4' + w, df_1, ['peeks' + w]),
+                    Task('variety' + w, df_5, ['df_2' + w, 'df_4' + w, 'peeks' + w], checkpoint=True),
+                ]
+        outputs += ['loyalty' + w, 'variety' + w]
+
+    results = run_dag(tasks, outputs=outputs + ['channels'], checkpoints=checkpoints)
+    scores = {
+        window_days: (results[2 * i], results[2 * i + 1])
+        for i, window_days in enumerate(windows)
+    }
 
-def process_final_data(loyalty, variety):
+    return scores, results[-1]
 
-    final_df = variety.merge(loyalty, on='name', how='left')
+@stage
+def process_final_data(loyalty, variety, channels, window_days=WINDOW_DAYS):
+
+    final_df = variety.merge(loyalty, on='twitch_channel_id', how='left')
     final_df = final_df[final_df['loyalty_category'].notnull()]
 
+    # Attach channel names and languages only for the output rows
+    final_df = final_df.merge(channels, on='twitch_channel_id', how='left')
+
     # Add 'variety_cat' column
-    conditions = [
-        (final_df['variety_game_score'] > 0.75),
-        (final_df['variety_game_score'] > 0.5) & (final_df['variety_game_score'] <= 0.75),
-        (final_df['variety_game_score'] > 0.25) & (final_df['variety_game_score'] <= 0.5),
-        (final_df['variety_game_score'] <= 0.25)
-    ]
+    final_df['variety_cat'] = variety_category(final_df['variety_game_score'])
 
-    # Correct 'variety_cat' classification by flipping the conditions
-    choices = [ 'Very Variety', 'Moderate Variety', 'Mostly One Category', 'One Category']
-    final_df['variety_cat'] = np.select(conditions, choices, default='Unknown')
+    final_df['window_days'] = window_days
 
     # Selecting required columns from final_df
     selected_columns = [
-        'twitch_channel_id', 'name', 'lang', 'acv', 'pct_shooter_airtime', 
+        'twitch_channel_id', 'window_days', 'name', 'lang', 'acv', 'pct_shooter_airtime', 
         'genre_rank_1', 'game_rank_1', 'variety_game_score', 
         'final_loyalty_score', 'variety_cat', 'loyalty_category'
     ]
 
     return final_df[selected_columns]
 
-def create_redshift_connection():
-    load_dotenv()
-    conn = psycopg2.connect(
-        dbname=os.getenv("REDSHIFT_DB"),
-        user=os.getenv("REDSHIFT_USER"),
-        password=os.getenv("REDSHIFT_PASSWORD"),
-        host=os.getenv("REDSHIFT_HOST"),
-        port=os.getenv("REDSHIFT_PORT")
-    )
-    logging.info("Connected to Redshift successfully!")
-
-    return conn
-
-def insert_to_twitch(df):
-    """Truncate table and insert DataFrame into PostgreSQL table."""
-    engine = db_connection()
-    table_name = 'loyalty_variety_scores'
-
-    # Truncate the table before inserting new data
-    with engine.connect() as connection:
-        connection.execute(text(f"TRUNCATE TABLE {table_name};"))
-        connection.commit()
-    logging.info(f"Table {table_name} truncated successfully from Twitch.")
-
-    # Insert DataFrame into the table
-    df.to_sql(table_name, con=engine, if_exists='append', index=False)
-    logging.info(f"Data inserted successfully into {table_name} table in Twitch.")
-
-# Function to insert DataFrame into Redshift
-def insert_data_to_redshift(df):
-    conn = create_redshift_connection()
-
-    insert_query = """
-    INSERT INTO loyalty_variety_scores ( twitch_channel_id, name, lang, acv, pct_shooter_airtime, genre_rank_1, 
-                                 game_rank_1, variety_game_score, final_loyalty_score, 
-                                 variety_cat, loyalty_category)
-    VALUES %s
-    """
-    
-    # Convert DataFrame rows to list of tuples
-    data_tuples = [tuple(row) for row in df.itertuples(index=False, name=None)]
-
-    with conn.cursor() as cursor:
-        cursor.execute("TRUNCATE TABLE loyalty_variety_scores;")
-        conn.commit()
-        logging.info(f"The table was truncated from Redshift before loading the data!")
-        execute_values(cursor, insert_query, data_tuples)
-        conn.commit()
-        logging.info(f"Inserted {len(df)} rows into Redshift!")
-    conn.close()
-
 if __name__ == "__main__":
     try:
         start_time = time.time()
+        reset_metrics()
+
+        # Overlapping cron runs would share the peek store and checkpoint directories
+        run_lock = acquire_run_lock()
+        if run_lock is None:
+            logging.info("Another run is still in progress, skipping.")
+            noop_message = (
+                f"\U0001F7E1 No-op \n\n"
+                f"       Name: loyalty_variety_scores \n"
+                f"       Status: The previous run is still in progress, tables left as they are. \n"
+            )
+            send_slack_message(noop_message)
+            sys.exit(0)
+
+        # Read before extracting, so data landing mid-run only causes another run next time
+        watermark = fetch_source_watermark()
+        if source_unchanged(watermark):
+            logging.info("Source unchanged since the last successful run, skipping.")
+            noop_message = (
+                f"\U0001F7E1 No-op \n\n"
+                f"       Name: loyalty_variety_scores \n"
+                f"       Status: Source unchanged since the last successful run (newest peek {watermark['max_pulled_at']}), tables left as they are. \n"
+            )
+            send_slack_message(noop_message)
+            sys.exit(0)
+
+        # A recent failed attempt for the same day and settings left checkpoints to resume from
+        checkpoints = open_run_checkpoints(
+            run_key(
+                today=watermark['today'], score_windows=watermark['score_windows'],
+                genres_csv=watermark['genres_csv'], outlier_mode=OUTLIER_MODE, variety_mode=VARIETY_MODE
+            ),
+            watermark=watermark, fresh=FORCE_RUN
+        )
 
-        loyalty, variety = function_call()
-        final_data = process_final_data(loyalty, variety)
-
-        insert_data_to_redshift(final_data)
-        insert_to_twitch(final_data)
+        scores, channels = function_call(checkpoints=checkpoints)
+        if checkpoints.has('final'):
+            final_data = checkpoints.load('final')
+        else:
+            final_data = pd.concat([
+                process_final_data(loyalty, variety, channels, window_days)
+                for window_days, (loyalty, variety) in scores.items()
+            ], ignore_index=True)
+            checkpoints.save('final', final_data)
+
+        publish_scores(final_data)
+
+        # Single-channel scoring categorizes against the cutoffs of what was just published;
+        # a window without scored channels has no cutoffs to save
+        cutoffs = {
+            window_days: loyalty_categories(loyalty['final_loyalty_score'])[1:]
+            for window_days, (loyalty, _) in scores.items()
+        }
+        save_loyalty_cutoffs({window_days: (bins, labels) for window_days, (bins, labels) in cutoffs.items() if bins})
+        # A resumed run published what its first attempt read, so record that attempt's watermark
+        write_watermark(checkpoints.watermark)
+        checkpoints.complete()
 
         end_time = time.time()
         elapsed_time_minutes = (end_time - start_time) / 60
@@ -140,6 +202,7 @@ if __name__ == "__main__":
             f"       Name: loyalty_variety_scores \n"
             f"       script_execution_time: {elapsed_time_minutes} Minutes \n"
             f"       Status: The data has been successfully loaded into table. \n"
+            f"       Stages: \n{format_run_summary()} \n"
             )
         send_slack_message(success_message)
 
@@ -148,6 +211,9 @@ if __name__ == "__main__":
             f"\u274C Alert! \n\n"
             f"       Name: loyalty_variety_scores \n"
             f"       Error: {e} \n"
+            f"       Stages: \n{format_run_summary()} \n"
         )
         send_slack_message(failure_message)
         logging.error("Error:", e)
+    finally:
+        dispose_engine()
@@ -0,0 +1,177 @@
+import os
+import json
+import pandas as pd
+from datetime import timedelta
+from sqlalchemy import text
+from db import execute_query
+from instrumentation import stage
+from extract import (
+    PEEK_SCHEMA, VIEWER_HISTOGRAM_SCHEMA, WINDOW_DAYS,
+    fetch_peek_batches, fetch_viewer_histogram_days, fetch_current_date, compact_peeks
+)
+
+STORE_DIR = os.getenv(
+    "PEEK_STORE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "state", "peeks")
+)
+MANIFEST = "_manifest.json"
+# Per-day viewer histograms live next to the peek partitions and are written with them
+HISTOGRAM_DIR = "viewers"
+# Bump when the partition columns change; partitions of another layout are refetched
+STORE_LAYOUT = 4
+# Days before today whose totals are rechecked for late peeks; older partitions are kept as written
+LATE_ARRIVAL_DAYS = int(os.getenv("PEEK_LATE_ARRIVAL_DAYS", 2))
+
+def partition_path(store_dir, day):
+    return os.path.join(store_dir, f"day={day.isoformat()}.parquet")
+
+def histogram_path(store_dir, day):
+    return os.path.join(store_dir, HISTOGRAM_DIR, f"day={day.isoformat()}.parquet")
+
+def store_window(today, window_days):
+    """Days the store keeps: `window_days` days before `today` and today itself."""
+    return [today - timedelta(days=i) for i in range(window_days, -1, -1)]
+
+def read_manifest(store_dir):
+    """Return {day: (samples, viewers_sum)} for every partition written so far in the current layout."""
+    path = os.path.join(store_dir, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get('layout') != STORE_LAYOUT:
+        return {}
+    return {pd.Timestamp(day).date(): tuple(totals) for day, totals in manifest['days'].items()}
+
+def write_manifest(store_dir, manifest):
+    path = os.path.join(store_dir, MANIFEST)
+    with open(path + ".tmp", "w") as f:
+        json.dump({
+            'layout': STORE_LAYOUT,
+            'days': {day.isoformat(): list(totals) for day, totals in sorted(manifest.items())}
+        }, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+def day_ranges(days):
+    """Group sorted days into contiguous (start, end) ranges."""
+    ranges = []
+    for day in sorted(days):
+        if ranges and day == ranges[-1][1] + timedelta(days=1):
+            ranges[-1][1] = day
+        else:
+            ranges.append([day, day])
+    return [tuple(r) for r in ranges]
+
+def fetch_day_totals(start_day):
+    """Return {day: (samples, viewers_sum)} of stream_peeks from `start_day` on."""
+    totals = execute_query(text("""
+        SELECT pulled_at::date AS day, COUNT(*) AS samples, COALESCE(SUM(viewers), 0) AS viewers_sum
+        FROM stream_peeks
+        WHERE pulled_at >= :start_day
+        GROUP BY 1
+    """).bindparams(start_day=start_day))
+
+    return {
+        pd.Timestamp(day).date(): (int(samples), int(viewers_sum))
+        for day, samples, viewers_sum in totals.itertuples(index=False)
+    }
+
+def write_parquet(df, path):
+    df.to_parquet(path + ".tmp", index=False)
+    os.replace(path + ".tmp", path)
+
+def write_partitions(store_dir, data, histograms, days, manifest):
+    """Write one peek and one viewer histogram Parquet file per day and record the totals it holds."""
+    data_days = pd.to_datetime(data['day']).dt.date
+    histogram_days = pd.to_datetime(histograms['day']).dt.date
+    for day in days:
+        part = data[data_days == day].reset_index(drop=True)
+        write_parquet(histograms[histogram_days == day].reset_index(drop=True), histogram_path(store_dir, day))
+        write_parquet(part, partition_path(store_dir, day))
+        manifest[day] = (int(part['samples'].sum()), int(part['viewers_sum'].sum()))
+
+@stage
+def sync_peek_store(store_dir=STORE_DIR, window_days=WINDOW_DAYS, late_days=LATE_ARRIVAL_DAYS):
+    """Bring the daily partitions up to date and return the window's peek table.
+
+    A cheap per-day count and viewer sum of the last `late_days` days and today
+    is compared with the totals each partition holds, and only days that are
+    missing or differ are fetched: today while it fills up, and any recent day
+    that received late peeks. Older partitions are only fetched when missing,
+    so delete the store to pick up peeks that arrived later than that.
+    Partitions that fell out of the window are removed.
+
+    Each day's viewer histogram, which the outlier filter rolls up, is
+    fetched and replaced together with its peek partition.
+    """
+    os.makedirs(os.path.join(store_dir, HISTOGRAM_DIR), exist_ok=True)
+    today = fetch_current_date()
+    window = store_window(today, window_days)
+
+    manifest = read_manifest(store_dir)
+    for day in [day for day in manifest if day < window[0]]:
+        for path in [partition_path(store_dir, day), histogram_path(store_dir, day)]:
+            if os.path.exists(path):
+                os.remove(path)
+        del manifest[day]
+
+    recheck_from = max(window[0], today - timedelta(days=late_days))
+    source = fetch_day_totals(recheck_from)
+    missing = [
+        day for day in window
+        if day not in manifest
+        or not os.path.exists(partition_path(store_dir, day))
+        or not os.path.exists(histogram_path(store_dir, day))
+        or (day >= recheck_from and manifest[day] != source.get(day, (0, 0)))
+    ]
+    print(f"Peek store has {len(window) - len(missing)} of {len(window)} days, fetching {len(missing)}")
+
+    for start_day, end_day in day_ranges(missing):
+        data = fetch_peek_batches(start_day, end_day)
+        histograms = fetch_peek_batches(start_day, end_day, fetch_days=fetch_viewer_histogram_days)
+        days = [day for day in missing if start_day <= day <= end_day]
+        write_partitions(store_dir, data, histograms, days, manifest)
+        write_manifest(store_dir, manifest)
+
+    write_manifest(store_dir, manifest)
+
+    return load_peek_window(store_dir, window)
+
+def load_peek_window(store_dir, window):
+    """Rebuild the compact peek table from the partitions of the given days."""
+    parts = [pd.read_parquet(partition_path(store_dir, day)) for day in window]
+    parts = [part for part in parts if not part.empty]
+    if not parts:
+        return compact_peeks(pd.DataFrame(columns=PEEK_SCHEMA.names))
+
+    peeks = pd.concat(parts, ignore_index=True)
+
+    # Partitions keep the names seen on their day; use the newest for every row
+    latest = peeks.sort_values('day', kind='mergesort')
+    channels = latest.drop_duplicates('twitch_channel_id', keep='last').set_index('twitch_channel_id')
+    games = latest.drop_duplicates('twitch_game_id', keep='last').set_index('twitch_game_id')
+    peeks['name'] = peeks['twitch_channel_id'].map(channels['name'])
+    peeks['lang'] = peeks['twitch_channel_id'].map(channels['lang'])
+    peeks['title'] = peeks['twitch_game_id'].map(games['title'])
+
+    peeks = compact_peeks(peeks)
+    print(f"Peek aggregate row count: {peeks.shape[0]}")
+
+    return peeks
+
+@stage
+def load_viewer_histograms(today, store_dir=STORE_DIR, window_days=WINDOW_DAYS):
+    """The window's per-day (channel, game, viewers, samples) histograms from the store.
+
+    Call after sync_peek_store has brought the store up to date for `today`.
+    """
+    parts = [pd.read_parquet(histogram_path(store_dir, day)) for day in store_window(today, window_days)]
+    parts = [part for part in parts if not part.empty]
+    if not parts:
+        histograms = VIEWER_HISTOGRAM_SCHEMA.empty_table().to_pandas()
+    else:
+        histograms = pd.concat(parts, ignore_index=True)
+    histograms['day'] = pd.to_datetime(histograms['day'])
+    print(f"Viewer histogram row count: {histograms.shape[0]}")
+
+    return histograms
@@ -0,0 +1,79 @@
+"""Local HTTP service for on-demand channel scores.
+
+    python scoring_service.py --port 8080
+    curl 'localhost:8080/scores?channel_id=123&channel_id=456'
+    curl localhost:8080/scores/123
+    curl 'localhost:8080/scores/123?window_days=30'
+
+Responses are JSON objects keyed by channel id; a null value means the channel
+did not qualify for scoring in the current window.
+"""
+import json
+import logging
+import argparse
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from db import dispose_engine
+from extract import WINDOW_DAYS
+from channel_scores import score_channels
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+class ScoreHandler(BaseHTTPRequestHandler):
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        if not parts or parts[0] != 'scores' or len(parts) > 2:
+            self.send_json(404, {'error': 'not found'})
+            return
+
+        params = parse_qs(url.query)
+        channel_ids = parts[1:] or params.get('channel_id', [])
+        channel_ids = [channel_id for value in channel_ids for channel_id in value.split(',') if channel_id]
+        if not channel_ids:
+            self.send_json(400, {'error': 'pass at least one channel_id'})
+            return
+
+        try:
+            window_days = int(params.get('window_days', [WINDOW_DAYS])[0])
+            results = score_channels((int(channel_id) for channel_id in channel_ids), window_days)
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        except Exception as e:
+            logging.exception("Scoring failed")
+            self.send_json(500, {'error': str(e)})
+            return
+
+        self.send_json(200, {str(channel_id): scores for channel_id, scores in results.items()})
+
+    def log_message(self, format, *args):
+        logging.info("%s - %s", self.address_string(), format % args)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), ScoreHandler)
+    logging.info(f"Serving channel scores on http://{args.host}:{args.port}/scores")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        dispose_engine()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+import os
+import tempfile
+import multiprocessing
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from concurrent.futures import ProcessPoolExecutor
+from extract import WINDOW_DAYS
+from instrumentation import stage
+from loyalty import df_2, process_df_6, score_loyalty, categorize_loyalty
+from variety_score import df_1, df_5
+
+# Number of channel shards scored in worker processes; 1 keeps scoring in-process
+SCORING_SHARDS = int(os.getenv("SCORING_SHARDS", 1))
+SCORING_WORKERS = int(os.getenv("SCORING_WORKERS", os.cpu_count() or 1))
+# Shard files live on tmpfs when it has room so workers map them straight from memory;
+# Docker gives containers a 64 MB /dev/shm unless started with a larger --shm-size
+SHARD_DIR = os.getenv("SHARD_DIR", "/dev/shm")
+
+def shard_ids(channel_ids, shards):
+    """Stable hash partition of channel ids into `shards` buckets."""
+    return (pd.util.hash_array(np.asarray(channel_ids, dtype='int64')) % np.uint64(shards)).astype('int64')
+
+def write_arrow(df, path):
+    """Write a frame as an uncompressed Arrow IPC file that readers can memory-map."""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    with pa.OSFile(path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+def read_arrow(path):
+    with pa.memory_map(path) as source:
+        return pa.ipc.open_file(source).read_all().to_pandas()
+
+def write_shards(peeks, outliers, shards, shard_dir):
+    """Split the peek table and outlier aggregates by channel hash into Arrow files per non-empty shard."""
+    buckets = shard_ids(peeks['twitch_channel_id'].to_numpy(), shards)
+    outlier_buckets = shard_ids(outliers['twitch_channel_id'].to_numpy(), shards)
+    paths = []
+    for shard in range(shards):
+        part = peeks[buckets == shard]
+        if part.empty:
+            continue
+        path = os.path.join(shard_dir, f"peeks_{shard}.arrow")
+        write_arrow(part, path)
+        write_arrow(outliers[outlier_buckets == shard], path.replace("peeks_", "outliers_"))
+        paths.append(path)
+
+    return paths
+
+def shard_dir_for(frames, shard_dir=SHARD_DIR):
+    """Return `shard_dir` if it can hold the shards and their results, else None for the temp dir.
+
+    Shard files hold every row once and the worker results are smaller, so
+    twice the frames' in-memory size is a safe bound for the Arrow files.
+    """
+    if not shard_dir or not os.path.isdir(shard_dir):
+        return None
+
+    needed = 2 * sum(int(frame.memory_usage(index=False, deep=True).sum()) for frame in frames)
+    stats = os.statvfs(shard_dir)
+    free = stats.f_bavail * stats.f_frsize
+    if free < needed:
+        print(f"{shard_dir} has {free >> 20} MB free, shards need ~{needed >> 20} MB; using the temp dir")
+        return None
+
+    return shard_dir
+
+def score_peeks(peeks, outliers, window_days=WINDOW_DAYS):
+    """Run the per-channel loyalty and variety stages; returns (uncategorized scores, variety)."""
+    df_2_result = df_2(peeks)
+    df_6_result = process_df_6(df_2_result, outliers, window_days)
+    scores = score_loyalty(df_6_result)
+
+    df_4_result = df_1(peeks)
+    variety = df_5(df_2_result, df_4_result, peeks)
+
+    return scores, variety
+
+def score_shard(peeks_path, window_days=WINDOW_DAYS):
+    """Worker: run the per-channel loyalty and variety stages on one shard."""
+    peeks = read_arrow(peeks_path)
+    outliers = read_arrow(peeks_path.replace("peeks_", "outliers_"))
+
+    scores, variety = score_peeks(peeks, outliers, window_days)
+
+    scores_path = peeks_path.replace("peeks_", "loyalty_")
+    variety_path = peeks_path.replace("peeks_", "variety_")
+    write_arrow(scores, scores_path)
+    write_arrow(variety, variety_path)
+
+    return scores_path, variety_path
+
+@stage
+def score_sharded(peeks, outliers, window_days=WINDOW_DAYS, shards=SCORING_SHARDS, workers=SCORING_WORKERS):
+    """Score channel shards in worker processes and merge them.
+
+    Every loyalty and variety stage groups by channel, so shards are independent
+    until the loyalty categories, whose quantiles are taken over the merged scores.
+    Returns (loyalty, variety) like the unsharded stages.
+    """
+    with tempfile.TemporaryDirectory(prefix="loyalty_shards_", dir=shard_dir_for([peeks, outliers])) as shard_dir:
+        paths = write_shards(peeks, outliers, shards, shard_dir)
+        if not paths:
+            # An empty window has nothing to shard; the stages still give the frames their columns
+            scores, variety = score_peeks(peeks, outliers, window_days)
+            return categorize_loyalty(scores), variety
+
+        print(f"Scoring {len(paths)} channel shards on {min(workers, len(paths))} workers")
+
+        # Spawned workers avoid inheriting locks held by the parent's threads at fork time
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=max(1, min(workers, len(paths))), mp_context=context) as executor:
+            results = list(executor.map(score_shard, paths, [window_days] * len(paths)))
+
+        scores = pd.concat([read_arrow(scores_path) for scores_path, _ in results], ignore_index=True)
+        variety = pd.concat([read_arrow(variety_path) for _, variety_path in results], ignore_index=True)
+
+    scores = scores.sort_values('twitch_channel_id').reset_index(drop=True)
+    variety = variety.sort_values('twitch_channel_id').reset_index(drop=True)
+
+    return categorize_loyalty(scores), variety
@@ -0,0 +1,199 @@
+import io
+import os
+import time
+import logging
+import contextvars
+import psycopg2
+import pandas as pd
+from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
+from psycopg2.extras import execute_values
+from instrumentation import stage, record_query
+
+# 'replace' rewrites both sinks, 'upsert' only sends rows that changed since the last publish
+SINK_MODE = os.getenv("SINK_MODE", "replace")
+SNAPSHOT_PATH = os.getenv(
+    "PUBLISHED_SNAPSHOT_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "state", "published_scores.parquet")
+)
+BATCH_SIZE = 1000
+
+TABLE_NAME = 'loyalty_variety_scores'
+# One row per channel and scoring window
+KEY_COLUMNS = ['twitch_channel_id', 'window_days']
+COLUMNS = [
+    'twitch_channel_id', 'window_days', 'name', 'lang', 'acv', 'pct_shooter_airtime', 'genre_rank_1',
+    'game_rank_1', 'variety_game_score', 'final_loyalty_score',
+    'variety_cat', 'loyalty_category'
+]
+
+def create_redshift_connection():
+    load_dotenv()
+    conn = psycopg2.connect(
+        dbname=os.getenv("REDSHIFT_DB"),
+        user=os.getenv("REDSHIFT_USER"),
+        password=os.getenv("REDSHIFT_PASSWORD"),
+        host=os.getenv("REDSHIFT_HOST"),
+        port=os.getenv("REDSHIFT_PORT")
+    )
+    logging.info("Connected to Redshift successfully!")
+
+    return conn
+
+def create_twitch_connection():
+    load_dotenv()
+    conn = psycopg2.connect(
+        dbname=os.getenv("twitch_DB_NAME"),
+        user=os.getenv("twitch_DB_USER"),
+        password=os.getenv("twitch_DB_PASSWORD"),
+        host=os.getenv("twitch_DB_HOST"),
+        port=os.getenv("twitch_DB_PORT")
+    )
+    logging.info("Connected to Twitch successfully!")
+
+    return conn
+
+def create_staging_table(cursor, table_name=TABLE_NAME, suffix='staging'):
+    """Create a session-local staging copy of the target table and return its name."""
+    staging_name = f"{table_name}_{suffix}"
+    cursor.execute(f"DROP TABLE IF EXISTS {staging_name};")
+    cursor.execute(f"CREATE TEMP TABLE {staging_name} (LIKE {table_name});")
+
+    return staging_name
+
+def swap_staging_table(cursor, staging_name, table_name=TABLE_NAME):
+    """Replace the target rows with the staged rows; readers see the old rows until commit."""
+    columns = ', '.join(COLUMNS)
+    cursor.execute(f"DELETE FROM {table_name};")
+    cursor.execute(f"INSERT INTO {table_name} ({columns}) SELECT {columns} FROM {staging_name};")
+    cursor.execute(f"DROP TABLE {staging_name};")
+
+def merge_staging_table(cursor, staging_name, deleted_name, table_name=TABLE_NAME):
+    """Upsert the staged rows and delete the staged keys of removed rows in one transaction."""
+    columns = ', '.join(COLUMNS)
+    for source in [staging_name, deleted_name]:
+        match = ' AND '.join(f"{table_name}.{key} = {source}.{key}" for key in KEY_COLUMNS)
+        cursor.execute(f"DELETE FROM {table_name} USING {source} WHERE {match};")
+    cursor.execute(f"INSERT INTO {table_name} ({columns}) SELECT {columns} FROM {staging_name};")
+    cursor.execute(f"DROP TABLE {staging_name};")
+    cursor.execute(f"DROP TABLE {deleted_name};")
+
+def copy_rows(cursor, table_name, df, columns=COLUMNS):
+    """Stream rows into a PostgreSQL table as CSV through COPY."""
+    buffer = io.StringIO()
+    df[columns].to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table_name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+def insert_rows(cursor, table_name, df, columns=COLUMNS):
+    """Insert rows with batched multi-row INSERTs.
+
+    Redshift's COPY only reads from S3 and similar sources, so this is its
+    bulk path.
+    """
+    staged = df[columns].astype(object)
+    data_tuples = list(staged.where(pd.notnull(staged), None).itertuples(index=False, name=None))
+    execute_values(
+        cursor,
+        f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES %s",
+        data_tuples,
+        page_size=BATCH_SIZE
+    )
+
+def write_scores(conn, load_rows, df, deleted_keys=None):
+    """Stage `df` and either swap it in or merge it with `deleted_keys`, in one transaction."""
+    start = time.perf_counter()
+    try:
+        with conn.cursor() as cursor:
+            staging_name = create_staging_table(cursor)
+            load_rows(cursor, staging_name, df)
+            if deleted_keys is None:
+                swap_staging_table(cursor, staging_name)
+            else:
+                deleted_name = create_staging_table(cursor, suffix='deleted')
+                load_rows(cursor, deleted_name, deleted_keys, columns=KEY_COLUMNS)
+                merge_staging_table(cursor, staging_name, deleted_name)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+        record_query(time.perf_counter() - start, len(df))
+
+@stage
+def insert_to_twitch(df, deleted_keys=None):
+    """Bulk-load the DataFrame into PostgreSQL with COPY and apply it atomically."""
+    write_scores(create_twitch_connection(), copy_rows, df, deleted_keys)
+    logging.info(f"Data loaded successfully into {TABLE_NAME} table in Twitch.")
+
+# Function to insert DataFrame into Redshift
+@stage
+def insert_data_to_redshift(df, deleted_keys=None):
+    """Load the DataFrame into Redshift through a staging table and apply it atomically."""
+    write_scores(create_redshift_connection(), insert_rows, df, deleted_keys)
+    logging.info(f"Inserted {len(df)} rows into Redshift!")
+
+def row_hashes(df):
+    """Content hash of every published column, one per row."""
+    return pd.util.hash_pandas_object(df[COLUMNS], index=False).to_numpy()
+
+def read_snapshot(path=SNAPSHOT_PATH):
+    if not os.path.exists(path):
+        return None
+    snapshot = pd.read_parquet(path)
+    # Snapshots keyed differently (e.g. before per-window rows) can't be diffed; replace instead
+    if list(snapshot.columns) != KEY_COLUMNS + ['row_hash']:
+        return None
+    return snapshot
+
+def write_snapshot(df, path=SNAPSHOT_PATH):
+    """Record the keys and row hashes that both sinks now hold."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    snapshot = df[KEY_COLUMNS].reset_index(drop=True)
+    snapshot['row_hash'] = row_hashes(df)
+    snapshot.to_parquet(path + ".tmp", index=False)
+    os.replace(path + ".tmp", path)
+
+def diff_scores(df, snapshot):
+    """Split `df` against the last published snapshot into changed rows and deleted keys."""
+    current = df[KEY_COLUMNS].reset_index(drop=True)
+    current['row_hash'] = row_hashes(df)
+
+    merged = current.merge(snapshot, on=KEY_COLUMNS, how='outer', suffixes=('', '_published'), indicator=True)
+    changed = merged[
+        (merged['_merge'] == 'left_only')
+        | ((merged['_merge'] == 'both') & (merged['row_hash'] != merged['row_hash_published']))
+    ][KEY_COLUMNS]
+    deleted_keys = merged[merged['_merge'] == 'right_only'][KEY_COLUMNS].reset_index(drop=True)
+
+    upserts = df.merge(changed, on=KEY_COLUMNS, how='inner')[df.columns]
+
+    return upserts, deleted_keys
+
+@stage
+def publish_scores(df, mode=SINK_MODE, snapshot_path=SNAPSHOT_PATH):
+    """Load both sinks concurrently and raise the first failure.
+
+    In upsert mode only rows whose content hash changed since the last
+    successful publish are sent; without a snapshot both sinks are replaced.
+    """
+    deleted_keys = None
+    snapshot = read_snapshot(snapshot_path) if mode == 'upsert' else None
+    if snapshot is not None:
+        rows, deleted_keys = diff_scores(df, snapshot)
+        logging.info(f"Upserting {len(rows)} changed rows and deleting {len(deleted_keys)} of {len(df)}.")
+        if rows.empty and deleted_keys.empty:
+            return
+    else:
+        rows = df
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [
+            executor.submit(contextvars.copy_context().run, insert_data_to_redshift, rows, deleted_keys),
+            executor.submit(contextvars.copy_context().run, insert_to_twitch, rows, deleted_keys)
+        ]
+        for future in futures:
+            future.result()
+
+    write_snapshot(df, snapshot_path)
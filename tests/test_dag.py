@@ -0,0 +1,126 @@
+import threading
+import time
+import pandas as pd
+import pytest
+from checkpoints import RunCheckpoints
+from dag import Task, run_dag
+
+class StageError(Exception):
+    pass
+
+def recorder():
+    calls = []
+    lock = threading.Lock()
+
+    def record(name, result=None):
+        def func(*args):
+            with lock:
+                calls.append(name)
+            return result if result is not None else pd.DataFrame({'stage': [name], 'inputs': [len(args)]})
+        return func
+
+    return calls, record
+
+def test_results_flow_to_dependents():
+    tasks = [
+        Task('a', lambda: 2),
+        Task('b', lambda: 3),
+        Task('sum', lambda a, b: a + b, ['a', 'b']),
+        Task('double', lambda total: total * 2, ['sum']),
+    ]
+
+    assert run_dag(tasks, ['double', 'a'], max_workers=2) == (10, 2)
+
+def test_first_failure_is_reraised_and_stops_new_tasks():
+    calls, record = recorder()
+    failed = threading.Event()
+
+    def fail():
+        failed.set()
+        raise StageError('boom')
+
+    def slow():
+        failed.wait(5)
+        # Finish after the failure is seen so the scheduler would otherwise start `after_slow`
+        time.sleep(0.2)
+        calls.append('slow')
+        return 1
+
+    tasks = [
+        Task('fail', fail),
+        Task('slow', slow),
+        Task('after_fail', record('after_fail'), ['fail']),
+        Task('after_slow', record('after_slow'), ['slow']),
+    ]
+
+    with pytest.raises(StageError, match='boom'):
+        run_dag(tasks, ['after_fail', 'after_slow'], max_workers=2)
+
+    # The running task is waited for, nothing new starts
+    assert calls == ['slow']
+
+def test_after_orders_without_passing_results():
+    calls, record = recorder()
+
+    def first():
+        time.sleep(0.1)
+        calls.append('first')
+        return 'first'
+
+    tasks = [
+        Task('first', first),
+        Task('second', record('second'), after=['first']),
+    ]
+
+    first_result, second_result = run_dag(tasks, ['first', 'second'], max_workers=2)
+
+    assert calls == ['first', 'second']
+    assert first_result == 'first'
+    assert second_result['inputs'].iloc[0] == 0
+
+def test_after_does_not_pull_in_unneeded_tasks():
+    calls, record = recorder()
+    tasks = [
+        Task('peeks', record('peeks')),
+        Task('outliers', record('outliers'), after=['peeks']),
+    ]
+
+    run_dag(tasks, ['outliers'], max_workers=2)
+
+    assert calls == ['outliers']
+
+def test_checkpoint_restore_skips_upstream_tasks(tmp_path):
+    def graph(record):
+        return [
+            Task('source', record('source')),
+            Task('other', record('other')),
+            Task('stage', record('stage'), ['source'], checkpoint=True),
+            Task('final', record('final'), ['stage', 'other']),
+        ]
+
+    calls, record = recorder()
+    first, = run_dag(graph(record), ['final'], max_workers=2, checkpoints=RunCheckpoints(str(tmp_path / 'run')))
+    assert sorted(calls) == ['final', 'other', 'source', 'stage']
+
+    calls, record = recorder()
+    resumed, = run_dag(graph(record), ['final'], max_workers=2, checkpoints=RunCheckpoints(str(tmp_path / 'run')))
+
+    # `stage` comes back from its Feather file, so `source` is never run again
+    assert sorted(calls) == ['final', 'other']
+    pd.testing.assert_frame_equal(resumed, first)
+
+def test_corrupt_checkpoint_is_recomputed(tmp_path):
+    calls, record = recorder()
+    tasks = [
+        Task('source', record('source')),
+        Task('stage', record('stage'), ['source'], checkpoint=True),
+    ]
+    checkpoints = RunCheckpoints(str(tmp_path / 'run'))
+    run_dag(tasks, ['stage'], checkpoints=checkpoints)
+    with open(checkpoints.path('stage'), 'ab') as f:
+        f.write(b'truncated')
+
+    calls.clear()
+    run_dag(tasks, ['stage'], checkpoints=RunCheckpoints(str(tmp_path / 'run')))
+
+    assert calls == ['source', 'stage']
@@ -0,0 +1,126 @@
+import datetime
+import numpy as np
+import pandas as pd
+import pytest
+import loyalty
+from loyalty import OUTLIER_COLUMNS, calculate_loyalty_score, loyalty_categories, filter_df_6_outliers, histogram_outlier_aggregates, window_start, process_df_6, score_loyalty, stream_df_6_filtered, weighted_percentiles
+
+TODAY = datetime.date(2024, 3, 31)
+
+def histogram_chunk(rows, windows):
+    columns = ['twitch_channel_id', 'twitch_game_id', 'viewers', *[f"samples_{w}" for w in windows]]
+    return pd.DataFrame(rows, columns=columns).astype('int64')
+
+def fake_stream(chunks):
+    def stream_query(query, dtypes=None, **kwargs):
+        yield from chunks
+    return stream_query
+
+def test_stream_df_6_filtered_empty_result(monkeypatch):
+    windows = [7, 30]
+    monkeypatch.setattr(loyalty, 'stream_query', fake_stream([histogram_chunk([], windows)]))
+
+    aggregates = stream_df_6_filtered(TODAY, windows)
+
+    assert aggregates.empty
+    assert set(aggregates.columns) == set(OUTLIER_COLUMNS)
+
+def test_empty_outliers_score_no_channels():
+    df_2_result = pd.DataFrame({'twitch_channel_id': np.array([1, 2], dtype='int64')})
+    outliers = pd.DataFrame(columns=OUTLIER_COLUMNS)
+
+    assert score_loyalty(process_df_6(df_2_result, outliers, 30)).empty
+
+def test_empty_window_scores_and_categorizes():
+    df_6 = pd.DataFrame({
+        'twitch_channel_id': pd.Series(dtype='int64'), 'twitch_game_id': pd.Series(dtype='int64'),
+        'mean': pd.Series(dtype='float64'), 'count': pd.Series(dtype='int64'),
+    })
+
+    loyalty_scores = calculate_loyalty_score(df_6)
+
+    assert loyalty_scores.empty
+    assert list(loyalty_scores.columns) == ['twitch_channel_id', 'loyalty_category', 'final_loyalty_score']
+
+    categories, bins, labels = loyalty_categories(pd.Series(dtype='float64'))
+    assert categories.empty
+    assert bins == []
+    assert labels == ['Low', 'Medium', 'High']
+
+def test_loyalty_categories_quantiles():
+    categories, bins, labels = loyalty_categories(pd.Series(np.arange(10, dtype='float64')))
+
+    assert labels == ['Low', 'Medium', 'High']
+    assert len(bins) == 4
+    assert categories.value_counts().to_dict() == {'High': 5, 'Medium': 3, 'Low': 2}
+
+def test_stream_df_6_filtered_skips_empty_chunks(monkeypatch):
+    windows = [7, 30]
+    rows = [
+        (1, 10, 100, 3, 5),
+        (1, 11, 120, 0, 2),
+        (2, 10, 50, 4, 4),
+    ]
+    chunks = [histogram_chunk(rows[:2], windows), histogram_chunk([], windows), histogram_chunk(rows[2:], windows)]
+    monkeypatch.setattr(loyalty, 'stream_query', fake_stream(chunks))
+
+    aggregates = stream_df_6_filtered(TODAY, windows)
+
+    expected = pd.concat([
+        filter_df_6_outliers(histogram_chunk(rows, windows).query("samples_7 > 0"), 'samples_7').assign(window_days=7),
+        filter_df_6_outliers(histogram_chunk(rows, windows), 'samples_30').assign(window_days=30),
+    ])
+    key = ['window_days', 'twitch_channel_id', 'twitch_game_id']
+    pd.testing.assert_frame_equal(
+        aggregates[OUTLIER_COLUMNS].sort_values(key).reset_index(drop=True),
+        expected[OUTLIER_COLUMNS].sort_values(key).reset_index(drop=True)
+    )
+
+def test_histogram_outlier_aggregates_match_stream(monkeypatch):
+    windows = [7, 30]
+    rng = np.random.default_rng(1)
+    n = 3000
+    peeks = pd.DataFrame({
+        'day': pd.to_datetime(TODAY) - pd.to_timedelta(rng.integers(0, 31, n), unit='D'),
+        'twitch_channel_id': rng.integers(1, 6, n),
+        'twitch_game_id': rng.integers(1, 4, n),
+        'viewers': np.where(rng.random(n) < 0.02, 5000, rng.integers(10, 40, n)),
+    })
+    histograms = peeks.groupby(['day', 'twitch_channel_id', 'twitch_game_id', 'viewers']).size().rename('samples').reset_index()
+
+    # What the streamed query returns: one row per channel, game and viewers with per-window counts
+    streamed = peeks.assign(**{
+        f"samples_{w}": (peeks['day'] >= pd.Timestamp(window_start(TODAY, w))).astype('int64') for w in windows
+    }).groupby(['twitch_channel_id', 'twitch_game_id', 'viewers'])[[f"samples_{w}" for w in windows]].sum().reset_index()
+    monkeypatch.setattr(loyalty, 'stream_query', fake_stream([streamed]))
+
+    key = ['window_days', 'twitch_channel_id', 'twitch_game_id']
+    expected = stream_df_6_filtered(TODAY, windows)[OUTLIER_COLUMNS].sort_values(key).reset_index(drop=True)
+    rolled_up = histogram_outlier_aggregates(TODAY, histograms, windows).sort_values(key).reset_index(drop=True)
+
+    assert not expected.empty
+    pd.testing.assert_frame_equal(rolled_up, expected, check_dtype=False)
+
+def test_histogram_outlier_aggregates_empty():
+    histograms = pd.DataFrame({
+        column: pd.Series(dtype='int64') for column in ['twitch_channel_id', 'twitch_game_id', 'viewers', 'samples']
+    }).assign(day=pd.Series(dtype='datetime64[ns]'))
+
+    assert histogram_outlier_aggregates(TODAY, histograms, [7, 30]).empty
+
+@pytest.mark.parametrize('percentiles', [[25, 75], [0, 50, 100]])
+def test_weighted_percentiles_match_numpy(percentiles):
+    rng = np.random.default_rng(0)
+    groups = [
+        (np.sort(rng.integers(0, 1000, size=size)).astype('float64'), rng.integers(1, 20, size=size))
+        for size in [1, 2, 7, 50]
+    ]
+    values = np.concatenate([group_values for group_values, _ in groups])
+    weights = np.concatenate([group_weights for _, group_weights in groups])
+    group_starts = np.cumsum([0] + [len(group_values) for group_values, _ in groups[:-1]])
+
+    results = weighted_percentiles(values, weights, group_starts, percentiles)
+
+    for i, (group_values, group_weights) in enumerate(groups):
+        expected = np.percentile(np.repeat(group_values, group_weights), percentiles)
+        np.testing.assert_allclose([result[i] for result in results], expected)
@@ -0,0 +1,19 @@
+import os
+import pandas as pd
+import sharding
+from sharding import shard_dir_for
+
+def test_shard_dir_used_when_it_has_room(tmp_path):
+    frame = pd.DataFrame({'twitch_channel_id': range(100)})
+
+    assert shard_dir_for([frame], str(tmp_path)) == str(tmp_path)
+
+def test_shard_dir_falls_back_to_temp_dir(tmp_path, monkeypatch):
+    frame = pd.DataFrame({'twitch_channel_id': range(100)})
+    assert shard_dir_for([frame], str(tmp_path / 'missing')) is None
+    assert shard_dir_for([frame], '') is None
+
+    # A 64 MB container /dev/shm with only a few blocks left
+    stats = os.statvfs(str(tmp_path))
+    monkeypatch.setattr(sharding.os, 'statvfs', lambda path: type(stats)((4096, 4096, 16384, 0, 0, 0, 0, 0, 0, 255)))
+    assert shard_dir_for([frame], str(tmp_path)) is None
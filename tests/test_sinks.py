@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+import pytest
+import sinks
+from checkpoints import open_feather, write_feather
+from sinks import COLUMNS, KEY_COLUMNS, diff_scores, publish_scores, read_snapshot, write_snapshot
+
+def make_scores(n=4):
+    return pd.DataFrame({
+        'twitch_channel_id': np.arange(1, n + 1, dtype='int64'),
+        'window_days': np.int64(30),
+        'name': [f'channel_{i}' for i in range(n)],
+        'lang': 'en',
+        'acv': np.linspace(10, 40, n),
+        'pct_shooter_airtime': np.linspace(0, 1, n),
+        'genre_rank_1': 'Shooter',
+        'game_rank_1': 'Valorant',
+        'variety_game_score': np.linspace(0.1, 0.9, n),
+        'final_loyalty_score': np.linspace(-1, 1, n),
+        'variety_cat': 'Very Variety',
+        'loyalty_category': np.resize(['Low', 'Medium', 'High'], n),
+    })[COLUMNS]
+
+def snapshot_of(df):
+    snapshot = df[KEY_COLUMNS].reset_index(drop=True)
+    snapshot['row_hash'] = sinks.row_hashes(df)
+    return snapshot
+
+def feather_round_trip(df, tmp_path):
+    """Restore a frame the way a checkpoint does, with the string columns categorical."""
+    path = str(tmp_path / 'final.feather')
+    write_feather(df.astype({column: 'category' for column in ['name', 'lang', 'loyalty_category']}), path)
+
+    return open_feather(path).to_pandas()
+
+def test_diff_no_changes():
+    df = make_scores()
+    upserts, deleted_keys = diff_scores(df, snapshot_of(df))
+    assert upserts.empty
+    assert deleted_keys.empty
+
+def test_diff_insert_change_delete():
+    published = make_scores()
+    current = published[published['twitch_channel_id'] != 2].copy()
+    current.loc[current['twitch_channel_id'] == 3, 'final_loyalty_score'] += 0.5
+    current = pd.concat([current, make_scores(5).iloc[[4]]], ignore_index=True)
+
+    upserts, deleted_keys = diff_scores(current, snapshot_of(published))
+
+    assert sorted(upserts['twitch_channel_id']) == [3, 5]
+    assert list(upserts.columns) == list(current.columns)
+    assert deleted_keys.to_dict('records') == [{'twitch_channel_id': 2, 'window_days': 30}]
+
+def test_diff_keys_include_window():
+    published = make_scores()
+    current = published.assign(window_days=np.int64(7))
+
+    upserts, deleted_keys = diff_scores(current, snapshot_of(published))
+
+    assert len(upserts) == len(current)
+    assert sorted(deleted_keys['twitch_channel_id']) == [1, 2, 3, 4]
+    assert set(deleted_keys['window_days']) == {30}
+
+def test_diff_categorical_matches_object_after_round_trip(tmp_path):
+    df = make_scores()
+    restored = feather_round_trip(df, tmp_path)
+    assert isinstance(restored['name'].dtype, pd.CategoricalDtype)
+
+    upserts, deleted_keys = diff_scores(restored, snapshot_of(df))
+    assert upserts.empty
+    assert deleted_keys.empty
+
+    upserts, deleted_keys = diff_scores(df, snapshot_of(restored))
+    assert upserts.empty
+    assert deleted_keys.empty
+
+def test_snapshot_round_trip(tmp_path):
+    df = make_scores()
+    path = str(tmp_path / 'snapshot.parquet')
+    write_snapshot(df, path)
+    upserts, deleted_keys = diff_scores(df, read_snapshot(path))
+    assert upserts.empty and deleted_keys.empty
+
+@pytest.fixture
+def sink_calls(monkeypatch):
+    calls = []
+    monkeypatch.setattr(sinks, 'insert_data_to_redshift', lambda rows, deleted: calls.append(('redshift', rows, deleted)))
+    monkeypatch.setattr(sinks, 'insert_to_twitch', lambda rows, deleted: calls.append(('twitch', rows, deleted)))
+    return calls
+
+def test_publish_upsert_sends_only_changes(tmp_path, sink_calls):
+    path = str(tmp_path / 'snapshot.parquet')
+    df = make_scores()
+
+    publish_scores(df, 'upsert', path)
+    assert [(sink, len(rows), deleted) for sink, rows, deleted in sink_calls] == [('redshift', 4, None), ('twitch', 4, None)]
+
+    sink_calls.clear()
+    publish_scores(df, 'upsert', path)
+    assert sink_calls == []
+
+    changed = df.copy()
+    changed.loc[0, 'acv'] = 99.0
+    publish_scores(changed, 'upsert', path)
+    assert [(sink, list(rows['twitch_channel_id']), len(deleted)) for sink, rows, deleted in sink_calls] == [
+        ('redshift', [1], 0), ('twitch', [1], 0)
+    ]
+
+def test_publish_replace_ignores_snapshot(tmp_path, sink_calls):
+    path = str(tmp_path / 'snapshot.parquet')
+    df = make_scores()
+    write_snapshot(df, path)
+
+    publish_scores(df, 'replace', path)
+    assert [(sink, len(rows), deleted) for sink, rows, deleted in sink_calls] == [('redshift', 4, None), ('twitch', 4, None)]
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+from extract import compact_peeks
+from loyalty import df_2
+from variety_score import df_1, df_5, top_k_ranks
+
+def make_peeks(n_games=12):
+    titles = ['Valorant', 'Fortnite', 'Minecraft', 'Just Chatting'] + [f'Game {i}' for i in range(n_games - 4)]
+    return compact_peeks(pd.DataFrame({
+        'day': pd.Timestamp('2024-03-30'),
+        'twitch_channel_id': np.int64(1),
+        'twitch_game_id': np.arange(1, n_games + 1, dtype='int64'),
+        'name': 'channel_1',
+        'lang': 'en',
+        'title': titles,
+        'samples': np.arange(n_games, 0, -1, dtype='int64') * 100,
+        'viewers_sum': np.arange(n_games, 0, -1, dtype='int64') * 1000,
+    }))
+
+@pytest.mark.parametrize('game_ranks, genre_ranks', [(5, 2), (12, 4)])
+def test_rank_counts_flow_through_df_5(game_ranks, genre_ranks):
+    peeks = make_peeks()
+
+    variety = df_5(df_2(peeks), df_1(peeks, game_ranks, genre_ranks), peeks, game_ranks, genre_ranks)
+
+    assert [c for c in variety.columns if c.startswith('game_rank_')] == [f'game_rank_{i}' for i in range(1, game_ranks + 1)]
+    assert [c for c in variety.columns if c.startswith('genre_rank_')] == [f'genre_rank_{i}' for i in range(1, genre_ranks + 1)]
+    assert variety['game_rank_1'].iloc[0] == 'Valorant'
+    assert variety[f'game_rank_{game_ranks}'].notnull().all()
+
+def pivot_ranks(frame, group_col, value_col, label_col, k, prefix):
+    """The rank + pivot_table ranking that top_k_ranks replaced."""
+    frame = frame.copy()
+    frame['rank'] = frame.groupby(group_col)[value_col].rank(method='first', ascending=False)
+    pivot = frame.pivot_table(index=group_col, columns='rank', values=label_col, aggfunc='first')
+    pivot = pivot.reindex(columns=range(1, k + 1)).rename(columns=lambda i: f'{prefix}_{i}')
+
+    return pivot.rename_axis(columns=None).reset_index()
+
+def test_top_k_ranks_matches_pivot_on_ties():
+    rng = np.random.default_rng(7)
+    frame = pd.DataFrame({
+        'twitch_channel_id': rng.integers(1, 40, 600),
+        'title': [f'Game {i}' for i in rng.integers(0, 60, 600)],
+        # Coarse shares so most channels have ties inside their top k
+        'game_percentage_played': rng.integers(0, 4, 600) / 4,
+    }).drop_duplicates(['twitch_channel_id', 'title']).reset_index(drop=True)
+    frame.loc[::17, 'game_percentage_played'] = np.nan
+
+    for k in (1, 3, 10):
+        expected = pivot_ranks(frame, 'twitch_channel_id', 'game_percentage_played', 'title', k, 'game_rank')
+        ranked = top_k_ranks(frame, 'twitch_channel_id', 'game_percentage_played', 'title', k, 'game_rank')
+
+        pd.testing.assert_frame_equal(ranked.astype(object), expected.astype(object))
@@ -1,75 +1,95 @@
+import os
+import time
 import pandas as pd
-from sqlalchemy import create_engine, text
 from datetime import datetime, timedelta
 import numpy as np
-from loyalty import execute_query
-
-def df_1():
-    query = """
-    SELECT 
-        sp.twitch_channel_id, 
-        sp.twitch_game_id, 
-        c.name AS channel_name, 
-        g.title AS game_title, 
-        SUM(sp.viewers) / 6 AS hours_watched
-    FROM stream_peeks sp
-    JOIN channels c ON c.twitch_channel_id = sp.twitch_channel_id
-    JOIN games g ON g.twitch_game_id = sp.twitch_game_id
-    WHERE sp.pulled_at >= CURRENT_DATE - INTERVAL '90 days'
-    GROUP BY sp.twitch_channel_id, sp.twitch_game_id, c.name, g.title
-    """
+from sqlalchemy import text
+from db import get_engine
+from extract import WINDOW_DAYS, channel_game_totals, channel_acv
+from instrumentation import stage, record_query
+from game_index import get_game_index
+
+# 'local' ranks from the shared peek table, 'sql' returns one finished row per channel from the database
+VARIETY_MODE = os.getenv("VARIETY_MODE", "local")
+
+# Number of ranked titles and genres kept per channel
+GAME_RANKS = int(os.getenv("GAME_RANKS", 10))
+GENRE_RANKS = int(os.getenv("GENRE_RANKS", 3))
+
+@stage
+def df_1(peeks, game_ranks=GAME_RANKS, genre_ranks=GENRE_RANKS):
+    # Channels and games missing from their dimension tables are left out, as with inner joins
+    peeks = peeks[peeks['name'].notnull() & peeks['title'].notnull()]
+    data = channel_game_totals(peeks, columns=('title',))
 
-    # Step : read the SQL query
-    data = execute_query(query)
+    # Integer division mirrors SUM(viewers) / 6 on the integer viewers column
+    data['hours_watched'] = data['viewers_sum'] // 6
 
     data['percentage_played'] = data.groupby('twitch_channel_id')['hours_watched'].transform(lambda x: x / x.sum())
     data['percentage_played_sq'] = data['percentage_played'] ** 2
 
-    result = data[data['game_title'].notnull()]
+    result = data[data['title'].notnull()]
 
     pd.options.display.float_format = '{:.6f}'.format
 
-    df_1 = result.rename(
-    columns={
-        'channel_name': 'name',
-            'game_title': 'title'
-        }
-    )[['twitch_channel_id', 'twitch_game_id', 'name', 'title', 
+    df_1 = result[['twitch_channel_id', 'twitch_game_id', 'title',
         'hours_watched', 'percentage_played', 'percentage_played_sq']]
     
     print(df_1.shape[0])
 
-    df = df_4(df_1)
+    df = df_4(df_1, game_ranks, genre_ranks)
     
     return df
 
-def df_4(df_1):
+def top_k_ranks(frame, group_col, value_col, label_col, k, prefix):
+    """Return the k highest-valued labels per group as prefix_1..prefix_k columns.
+
+    Ties keep their row order, matching rank(method='first', ascending=False).
+    """
+    frame = frame[frame[value_col].notnull()]
+    groups, group_keys = pd.factorize(frame[group_col], sort=True)
+    label_codes, labels = pd.factorize(frame[label_col])
+    values = frame[value_col].to_numpy(dtype='float64')
+
+    # Sort by group, then descending value, then original row position
+    order = np.lexsort((np.arange(len(frame)), -values, groups))
+    sorted_groups = groups[order]
+    group_starts = np.flatnonzero(np.diff(sorted_groups, prepend=-1))
+    group_sizes = np.diff(np.append(group_starts, len(order)))
+    positions = np.arange(len(order)) - np.repeat(group_starts, group_sizes)
+
+    keep = positions < k
+    ranked = np.full((len(group_keys), k), -1, dtype='int64')
+    ranked[sorted_groups[keep], positions[keep]] = label_codes[order[keep]]
+
+    result = pd.DataFrame({group_col: group_keys})
+    for i in range(k):
+        result[f'{prefix}_{i + 1}'] = pd.Categorical.from_codes(ranked[:, i], categories=np.asarray(labels))
+
+    return result
+
+@stage
+def df_4(df_1, game_ranks=GAME_RANKS, genre_ranks=GENRE_RANKS):
     
-    # Step : Load genres data from CSV
-    # genres = pd.read_csv("/app/game_genres.csv")  # File with columns: Game, Primary Genre
-    genres = pd.read_csv("/home/ec2-user/Loyalty_Variety_score/game_genres.csv")
-    genre_playtime = pd.merge(df_1, genres, how='left', left_on='title', right_on='Game')
+    # Step : Look up genres in the game classification index
+    games = get_game_index()
+    genre_playtime = df_1.assign(genre=games.genre(games.game_rows(df_1['twitch_game_id'], df_1['title'])))
 
-    genre_playtime = genre_playtime[genre_playtime['Primary Genre'].notnull()]
-    genre_playtime['genre'] = genre_playtime['Primary Genre']  # Rename Primary Genre to genre
+    genre_playtime = genre_playtime[genre_playtime['genre'].notnull()]
 
     genre_playtime['sum_hours_watched'] = genre_playtime.groupby('twitch_channel_id')['hours_watched'].transform('sum')
     genre_playtime['genre_percentage_played'] = genre_playtime['hours_watched'] / genre_playtime['sum_hours_watched']
     genre_playtime['genre_percentage_played_sq'] = genre_playtime['genre_percentage_played'] ** 2
-    genre_percentages = genre_playtime.groupby(['name', 'genre'], as_index=False).agg(
+    genre_percentages = genre_playtime.groupby(['twitch_channel_id', 'genre'], as_index=False, observed=True).agg(
         genre_percentage_played=('genre_percentage_played', 'sum')
     )
     genre_percentages['genre_percentage_played_sq'] = genre_percentages['genre_percentage_played'] ** 2
 
-    genre_percentages['genre_rank'] = genre_percentages.groupby('name')['genre_percentage_played'].rank(method='first', ascending=False)
-
-    genre_rank_schema = genre_percentages.pivot_table(index='name', 
-                                                    columns='genre_rank', 
-                                                    values='genre', 
-                                                    aggfunc='first')
-    genre_rank_schema = genre_rank_schema.rename(columns={1: 'genre_rank_1', 2: 'genre_rank_2', 3: 'genre_rank_3'})
+    genre_rank_schema = top_k_ranks(
+        genre_percentages, 'twitch_channel_id', 'genre_percentage_played', 'genre', genre_ranks, 'genre_rank'
+    )
 
-    variety_scores = genre_percentages.groupby('name', as_index=False).agg(
+    variety_scores = genre_percentages.groupby('twitch_channel_id', as_index=False).agg(
         variety_genre_score=('genre_percentage_played_sq', 'sum')
     )
 
@@ -78,62 +98,190 @@ def df_4(df_1):
     game_playtime['game_percentage_played'] = game_playtime['hours_watched'] / game_playtime['sum_hours_watched']
     game_playtime['game_percentage_played_sq'] = game_playtime['game_percentage_played'] ** 2
 
-    game_percentages = game_playtime.groupby(['name', 'title'], as_index=False).agg(
+    game_percentages = game_playtime.groupby(['twitch_channel_id', 'title'], as_index=False, observed=True).agg(
         game_percentage_played=('game_percentage_played', 'sum'),
         game_percentage_played_sq=('game_percentage_played_sq', 'sum')
     )
 
-    game_percentages['game_rank'] = game_percentages.groupby('name')['game_percentage_played'].rank(method='first', ascending=False)
-
-    game_rank_schema = game_percentages.pivot_table(index='name', 
-                                                columns='game_rank', 
-                                                values='title', 
-                                                aggfunc='first')
-    game_rank_schema = game_rank_schema.rename(columns={i: f'game_rank_{i}' for i in range(1, 11)})
+    game_rank_schema = top_k_ranks(
+        game_percentages, 'twitch_channel_id', 'game_percentage_played', 'title', game_ranks, 'game_rank'
+    )
 
-    game_variety_scores = game_percentages.groupby('name', as_index=False).agg(
+    game_variety_scores = game_percentages.groupby('twitch_channel_id', as_index=False).agg(
         variety_game_score=('game_percentage_played_sq', 'sum')
     )
 
     # Inverting variety_game_score to ensure higher scores indicate more variety
     game_variety_scores['variety_game_score'] = 1 - game_variety_scores['variety_game_score']
 
-    final_result = pd.merge(variety_scores, game_variety_scores, on='name', how='left')
-    final_result = pd.merge(final_result, genre_rank_schema, on='name', how='left')
-    final_result = pd.merge(final_result, game_rank_schema, on='name', how='left')
+    final_result = pd.merge(variety_scores, game_variety_scores, on='twitch_channel_id', how='left')
+    final_result = pd.merge(final_result, genre_rank_schema, on='twitch_channel_id', how='left')
+    final_result = pd.merge(final_result, game_rank_schema, on='twitch_channel_id', how='left')
 
     # Step : Keep only the required columns
     df_4 = final_result[[
-        'name',
+        'twitch_channel_id',
         'variety_game_score',
-        'game_rank_1', 'game_rank_2', 'game_rank_3', 'game_rank_4', 'game_rank_5',
-        'game_rank_6', 'game_rank_7', 'game_rank_8', 'game_rank_9', 'game_rank_10',
+        *[f'game_rank_{i}' for i in range(1, game_ranks + 1)],
         'variety_genre_score',
-        'genre_rank_1', 'genre_rank_2', 'genre_rank_3'
+        *[f'genre_rank_{i}' for i in range(1, genre_ranks + 1)]
     ]]
 
     return df_4
 
-def df_5(df_2, df_4):
-    df = df_2.merge(df_4, on='name', how='left')
+VARIETY_QUERY = """
+    WITH totals AS (
+        SELECT sp.twitch_channel_id, sp.twitch_game_id, games.title, SUM(sp.viewers) / 6 AS hours_watched
+        FROM stream_peeks sp
+        JOIN channels ON channels.twitch_channel_id = sp.twitch_channel_id
+        JOIN games ON games.twitch_game_id = sp.twitch_game_id
+        WHERE sp.pulled_at >= CURRENT_DATE - INTERVAL '{window_days} days'
+          AND channels.name IS NOT NULL AND games.title IS NOT NULL
+        GROUP BY 1, 2, 3
+    ),
+    shares AS (
+        SELECT
+            t.twitch_channel_id,
+            t.title,
+            g.genre,
+            t.hours_watched::float8
+                / NULLIF(SUM(t.hours_watched) OVER (PARTITION BY t.twitch_channel_id), 0) AS game_share,
+            CASE WHEN g.genre IS NOT NULL THEN t.hours_watched::float8 / NULLIF(SUM(
+                CASE WHEN g.genre IS NOT NULL THEN t.hours_watched END
+            ) OVER (PARTITION BY t.twitch_channel_id), 0) END AS genre_share
+        FROM totals t
+        LEFT JOIN {genre_table} g ON g.twitch_game_id = t.twitch_game_id
+    ),
+    game_titles AS (
+        SELECT
+            twitch_channel_id,
+            title,
+            COALESCE(SUM(game_share), 0) AS share,
+            COALESCE(SUM(game_share * game_share), 0) AS share_sq,
+            ROW_NUMBER() OVER (
+                PARTITION BY twitch_channel_id ORDER BY COALESCE(SUM(game_share), 0) DESC, title COLLATE "C"
+            ) AS rank
+        FROM shares
+        GROUP BY 1, 2
+    ),
+    genres AS (
+        SELECT
+            twitch_channel_id,
+            genre,
+            COALESCE(SUM(genre_share), 0) AS share,
+            ROW_NUMBER() OVER (
+                PARTITION BY twitch_channel_id ORDER BY COALESCE(SUM(genre_share), 0) DESC, genre COLLATE "C"
+            ) AS rank
+        FROM shares
+        WHERE genre IS NOT NULL
+        GROUP BY 1, 2
+    ),
+    game_scores AS (
+        SELECT twitch_channel_id, 1 - SUM(share_sq) AS variety_game_score, {game_rank_columns}
+        FROM game_titles
+        GROUP BY 1
+    ),
+    genre_scores AS (
+        SELECT twitch_channel_id, SUM(share * share) AS variety_genre_score, {genre_rank_columns}
+        FROM genres
+        GROUP BY 1
+    ),
+    acv AS (
+        SELECT twitch_channel_id, AVG(viewers::float8) AS acv
+        FROM stream_peeks
+        WHERE pulled_at >= CURRENT_DATE - INTERVAL '{window_days} days'
+        GROUP BY 1
+    )
+    SELECT
+        acv.twitch_channel_id,
+        gs.variety_game_score,
+        {game_rank_names},
+        ge.variety_genre_score,
+        {genre_rank_names},
+        acv.acv
+    FROM acv
+    LEFT JOIN genre_scores ge ON ge.twitch_channel_id = acv.twitch_channel_id
+    LEFT JOIN game_scores gs ON gs.twitch_channel_id = ge.twitch_channel_id
+"""
 
-    query = """
-        select twitch_channel_id,
-        avg(viewers) as acv
-        from stream_peeks
-        where pulled_at >= CURRENT_DATE - INTERVAL '90 days'
-        group by twitch_channel_id 
-        """
+def rank_columns(label_col, prefix, k):
+    return ', '.join(f"MAX(CASE WHEN rank = {i} THEN {label_col} END) AS {prefix}_{i}" for i in range(1, k + 1))
 
-    # Step : Use pandas to read the SQL query result directly into a DataFrame
-    df_5 = execute_query(query)
+def load_genre_table(connection, table_name='game_genres_tmp'):
+    """Load twitch_game_id -> genre from the game index into a session temp table."""
+    games = pd.read_sql(text("SELECT twitch_game_id, title FROM games WHERE title IS NOT NULL"), connection)
+    index = get_game_index()
+    genres = pd.DataFrame({
+        'twitch_game_id': games['twitch_game_id'].astype('int64'),
+        'genre': index.genre(index.game_rows(games['twitch_game_id'], games['title']))
+    }).dropna()
 
-    df_f = df.merge(df_5, on='twitch_channel_id', how='left')
-    df = df_f_fun(df_f)
+    connection.execute(text(f"DROP TABLE IF EXISTS {table_name}"))
+    connection.execute(text(f"CREATE TEMP TABLE {table_name} (twitch_game_id BIGINT PRIMARY KEY, genre TEXT)"))
+    if not genres.empty:
+        connection.execute(
+            text(f"INSERT INTO {table_name} (twitch_game_id, genre) VALUES (:twitch_game_id, :genre)"),
+            [{'twitch_game_id': int(game_id), 'genre': str(genre)} for game_id, genre in genres.itertuples(index=False)]
+        )
+
+    return table_name
+
+@stage
+def fetch_df_4(window_days=WINDOW_DAYS, game_ranks=GAME_RANKS, genre_ranks=GENRE_RANKS, engine=None):
+    """df_4 plus acv computed in the database, one row per channel in the window.
+
+    Shares, HHI and top-k ranks are window functions over channel x game
+    totals; ties rank by title/genre in code-point order like the local
+    path. Channels without a classified game keep acv but no variety fields.
+    """
+    engine = engine or get_engine()
+    query = VARIETY_QUERY.format(
+        window_days=int(window_days),
+        genre_table='{genre_table}',
+        game_rank_columns=rank_columns('title', 'game_rank', game_ranks),
+        genre_rank_columns=rank_columns('genre', 'genre_rank', genre_ranks),
+        game_rank_names=', '.join(f"gs.game_rank_{i}" for i in range(1, game_ranks + 1)),
+        genre_rank_names=', '.join(f"ge.genre_rank_{i}" for i in range(1, genre_ranks + 1))
+    )
+
+    start = time.perf_counter()
+    with engine.connect() as connection:
+        genre_table = load_genre_table(connection)
+        df_4 = pd.read_sql(text(query.format(genre_table=genre_table)), connection)
+        connection.execute(text(f"DROP TABLE {genre_table}"))
+        connection.commit()
+    record_query(time.perf_counter() - start, len(df_4))
+    print(f"Fetched {df_4.shape[0]} channel variety rows")
+
+    return df_4
+
+@stage
+def df_5(df_2, df_4, peeks=None, game_ranks=GAME_RANKS, genre_ranks=GENRE_RANKS):
+    df = df_2.merge(df_4, on='twitch_channel_id', how='left')
+
+    # Step : Average viewers per channel from the shared peek table, unless fetch_df_4 returned it
+    if 'acv' not in df_4.columns:
+        df_5 = channel_acv(peeks)
+        df = df.merge(df_5, on='twitch_channel_id', how='left')
+
+    df = df_f_fun(df, game_ranks, genre_ranks)
 
     return df
 
-def df_f_fun(df_f):
+def variety_category(variety_game_score):
+    """Label variety_game_score as one of the four variety categories."""
+    conditions = [
+        (variety_game_score > 0.75),
+        (variety_game_score > 0.5) & (variety_game_score <= 0.75),
+        (variety_game_score > 0.25) & (variety_game_score <= 0.5),
+        (variety_game_score <= 0.25)
+    ]
+
+    # Correct 'variety_cat' classification by flipping the conditions
+    choices = [ 'Very Variety', 'Moderate Variety', 'Mostly One Category', 'One Category']
+    return np.select(conditions, choices, default='Unknown')
+
+def df_f_fun(df_f, game_ranks=GAME_RANKS, genre_ranks=GENRE_RANKS):
     def categorize_shooter(pct_shooter_airtime):
         if 0.2 <= pct_shooter_airtime <= 0.5:
             return 'enthusiast_2050'
@@ -151,11 +299,11 @@ def df_f_fun(df_f):
     # Selecting required columns
     selected_columns = [
         
-        'twitch_channel_id', 'name', 'acv', 'lang', 'shooter_group',
+        'twitch_channel_id', 'acv', 'shooter_group',
         'pct_shooter_airtime', 'pct_nonshooter_airtime', 'pct_non_gaming', 'total_airtime',
-        'variety_game_score', 'genre_rank_1', 'genre_rank_2', 'genre_rank_3',
-        'game_rank_1', 'game_rank_2', 'game_rank_3', 'game_rank_4', 'game_rank_5',
-        'game_rank_6', 'game_rank_7', 'game_rank_8', 'game_rank_9', 'game_rank_10'
+        'variety_game_score',
+        *[f'genre_rank_{i}' for i in range(1, genre_ranks + 1)],
+        *[f'game_rank_{i}' for i in range(1, game_ranks + 1)]
     ]
 
     return df_f[selected_columns]
@@ -0,0 +1,80 @@
+import os
+import json
+import fcntl
+from sqlalchemy import text
+from db import execute_query
+from extract import SCORE_WINDOWS, WINDOW_DAYS
+from game_index import GENRES_CSV, csv_fingerprint
+from instrumentation import stage
+
+WATERMARK_PATH = os.getenv(
+    "WATERMARK_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "state", "watermark.json")
+)
+# Held for the whole run so overlapping cron runs never share checkpoints or the peek store
+LOCK_PATH = os.getenv(
+    "RUN_LOCK_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "state", "run.lock")
+)
+# Set FORCE_RUN=1 to score and publish even when the source looks unchanged
+FORCE_RUN = os.getenv("FORCE_RUN", "0").lower() in ("1", "true", "yes")
+
+@stage
+def fetch_source_watermark(window_days=WINDOW_DAYS, csv_path=GENRES_CSV):
+    """Cheap summary of everything the scores depend on.
+
+    The window moves with CURRENT_DATE, new or late peeks change the newest
+    pulled_at or the window's row count, and the dimension counts and genre
+    CSV fingerprint cover new channels, games and classifications.
+    """
+    source = execute_query(text(f"""
+        SELECT
+            CURRENT_DATE AS today,
+            (SELECT MAX(pulled_at) FROM stream_peeks) AS max_pulled_at,
+            (SELECT COUNT(*) FROM stream_peeks
+             WHERE pulled_at >= CURRENT_DATE - INTERVAL '{int(window_days)} days') AS window_peeks,
+            (SELECT COUNT(*) FROM channels) AS channels,
+            (SELECT COUNT(*) FROM games) AS games
+    """)).iloc[0]
+
+    return {
+        'today': str(source['today']),
+        'max_pulled_at': str(source['max_pulled_at']),
+        'window_peeks': int(source['window_peeks']),
+        'channels': int(source['channels']),
+        'games': int(source['games']),
+        'genres_csv': csv_fingerprint(csv_path),
+        'score_windows': list(SCORE_WINDOWS),
+    }
+
+def read_watermark(path=WATERMARK_PATH):
+    """Watermark of the last successful run, or None."""
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def write_watermark(watermark, path=WATERMARK_PATH):
+    """Record the watermark once both sinks hold the scores computed from it."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(watermark, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+def source_unchanged(watermark, path=WATERMARK_PATH):
+    return not FORCE_RUN and watermark == read_watermark(path)
+
+def acquire_run_lock(path=LOCK_PATH):
+    """Take the exclusive run lock without waiting; returns the open lock file, or None if it is held.
+
+    Keep the returned file open for the rest of the run. The lock is released
+    when it is closed or the process exits.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    lock = open(path, "a")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        return None
+    return lock